@@ -0,0 +1,48 @@
+#! /usr/bin/env python
+#! -*- coding:utf-8 -*-
+
+# Copyright (c) 2007, PediaPress GmbH
+# See README.txt for additional licensing information.
+
+"""Benchmark RlWriter.breakLongLines with wide logs and minified code.
+
+usage: python benchmarks/breaklines.py [NUMLINES]
+"""
+
+import random
+import sys
+import time
+
+from mwlib.rl.rlwriter import RlWriter
+
+
+def make_log(num_lines):
+    words = ['GET', '/index.php?title=Main_Page', 'HTTP/1.1', '200', '<b>ERROR</b>', '&lt;null&gt;', '-']
+    rnd = random.Random(0)
+    return '\n'.join(' '.join(rnd.choice(words) for i in range(60)) for j in range(num_lines))
+
+
+def make_minified(num_lines):
+    line = ''.join('<font color="#%06x">var%d=%d;</font>' % (i, i, i) for i in range(400))
+    return '\n'.join([line] * num_lines)
+
+
+def run(name, txt, char_limit, repeat=3):
+    r = RlWriter(test_mode=True)
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        res = r.breakLongLines(txt, char_limit)
+        t = time.time() - start
+        best = t if best is None else min(best, t)
+    print '%-10s %8d chars in -> %6d lines out: %.3fs' % (name, len(txt), res.count('\n') + 1, best)
+
+
+def main():
+    num_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    run('log', make_log(num_lines), 80)
+    run('minified', make_minified(max(1, num_lines / 20)), 80)
+
+
+if __name__ == '__main__':
+    main()
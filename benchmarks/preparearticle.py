@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+#! -*- coding:utf-8 -*-
+
+# Copyright (c) 2007, PediaPress GmbH
+# See README.txt for additional licensing information.
+
+"""Benchmark the preparation of an article for RlWriter.writeArticle.
+
+Times the steps of RlWriter.buildArticle after parsing and the number of
+times each step looks up the children of a node (per node of the tree). 'css + prepare' is the
+separate CustomNodeTransformer.transformCSS walk followed by
+RlWriter.prepareWrite, which applies the css_map itself.
+
+usage: python benchmarks/preparearticle.py [NUMPARAGRAPHS]
+"""
+
+import copy
+import sys
+import time
+
+import mwlib.ext
+from mwlib import uparser, advtree
+from mwlib.rl.rlwriter import RlWriter
+from writearticle import count_nodes # in the directory of this script, i.e. on sys.path
+
+
+def count_visits(func, tree):
+    """number of node.children lookups while func(tree) runs"""
+    visits = [0]
+    def children(self):
+        visits[0] += 1
+        return self.__dict__['children']
+    advtree.Node.children = property(children, lambda self, val: self.__dict__.__setitem__('children', val))
+    try:
+        func(tree)
+    finally:
+        del advtree.Node.children
+    return visits[0]
+
+
+def main():
+    num_paragraphs = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    para = u"Some ''text'' with '''bold''' and [[Link|links]] and <span class=\"rtl\" style=\"color:red\">red</span> words. " * 10
+    raw = u'== Head ==\n' + (para + u'\n\n{|\n|-\n| cell || <div style="text-align:center">cell</div>\n|}\n\n') * num_paragraphs
+    parsed = uparser.parseString(title='Big', raw=raw)
+    r = RlWriter(test_mode=True)
+
+    def build(tree):
+        advtree.buildAdvancedTree(tree)
+    def clean(tree):
+        r.tc.tree = tree
+        r.tc.cleanAll()
+    def separate(tree):
+        r.cnt.transformCSS(tree)
+        r.prepareWrite(tree)
+    steps = [('buildAdvancedTree', build), ('cleanAll', clean),
+             ('css + prepare', separate), ('prepareWrite', r.prepareWrite)]
+
+    trees = {}
+    tree = copy.deepcopy(parsed)
+    build(tree)
+    trees['cleanAll'] = tree
+    tree = copy.deepcopy(tree)
+    clean(tree)
+    trees['css + prepare'] = trees['prepareWrite'] = tree
+    trees['buildAdvancedTree'] = parsed
+    num_nodes = count_nodes(tree)
+    print '%d nodes after cleaning' % num_nodes
+    for name, func in steps:
+        best = None
+        for i in range(3):
+            t = copy.deepcopy(trees[name])
+            start = time.time()
+            func(t)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        visits = count_visits(func, copy.deepcopy(trees[name]))
+        print '%-20s %.3fs %6.1f children lookups/node' % (name, best, visits / float(num_nodes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#! /usr/bin/env python
+#! -*- coding:utf-8 -*-
+
+# Copyright (c) 2007, PediaPress GmbH
+# See README.txt for additional licensing information.
+
+"""Benchmark RlWriter.writeArticle on a large article with many small nodes.
+
+usage: python benchmarks/writearticle.py [NUMPARAGRAPHS]
+"""
+
+import copy
+import sys
+import time
+
+import mwlib.ext
+from mwlib import uparser, advtree
+from mwlib.treecleaner import TreeCleaner
+from mwlib.rl.rlwriter import RlWriter
+
+
+def make_article(num_paragraphs):
+    para = u"Some ''text'' with '''bold''' and [[Link|links]] and <span style=\"color:red\">red</span> words. " * 10
+    raw = u'== Head ==\n' + (para + u'\n\n<div style="page-break-before:50%">x</div>\n\n') * num_paragraphs
+    art = uparser.parseString(title='Big', raw=raw)
+    advtree.buildAdvancedTree(art)
+    TreeCleaner(art).cleanAll()
+    return art
+
+
+def count_nodes(node):
+    return 1 + sum(count_nodes(c) for c in node.children)
+
+
+def main():
+    num_paragraphs = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    art = make_article(num_paragraphs)
+    r = RlWriter(test_mode=True)
+    best = None
+    for i in range(3):
+        a = copy.deepcopy(art)
+        if hasattr(r, 'prepareWrite'):
+            r.prepareWrite(a)
+        start = time.time()
+        r.writeArticle(a)
+        t = time.time() - start
+        best = t if best is None else min(best, t)
+    print '%d nodes: %.3fs' % (count_nodes(art), best)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#! /usr/bin/env python
+#! -*- coding:utf-8 -*-
+
+# Copyright (c) 2007, PediaPress GmbH
+# See README.txt for additional licensing information.
+
+from mwlib import advtree
+from mwlib.writer import styleutils
+
+_text_aligns = ['left', 'center', 'right', 'justify', 'none']
+
+
+class ComputedStyle(object):
+    """The inherited style values of a node: text color and background
+    color (rgb triples or None) and text alignment, resolved like
+    styleutils.rgbColorFromNode, rgbBgColorFromNode and getTextAlign do.
+
+    Computed styles are immutable. A node without own color, background
+    or alignment shares the computed style of its parent.
+    """
+
+    def __init__(self, color=None, background=None, text_align='none'):
+        self.color = color
+        self.background = background
+        self.text_align = text_align
+
+    def derive(self, node):
+        """computed style of node if self is the one of its parent"""
+        style = node.style
+        attributes = node.attributes
+        color = self.color
+        if style.get('color') or attributes.get('color'):
+            color = styleutils.rgbColorFromNode(node)
+        background = self.background
+        if attributes.get('bgcolor') or style.get('background') or style.get('background-color'):
+            background = styleutils.rgbBgColorFromNode(node, follow=False)
+        cls = node.__class__
+        text_align = style.get('text-align', 'none').lower()
+        if text_align == 'none' and cls in (advtree.Div, advtree.Cell, advtree.Row):
+            text_align = attributes.get('align', 'none').lower()
+        if text_align not in _text_aligns:
+            text_align = 'left'
+        elif cls == advtree.Center:
+            text_align = 'center'
+        if text_align == 'none':
+            text_align = self.text_align
+        if (color, background, text_align) == (self.color, self.background, self.text_align):
+            return self
+        return ComputedStyle(color, background, text_align)
+
+
+_root_style = ComputedStyle()
+
+def getComputedStyle(node):
+    """the style stored by RlWriter.prepareWrite or the one computed from the parents of node"""
+    try:
+        return node._computed_style
+    except AttributeError:
+        computed = _root_style
+        for n in node.getParents() + [node]:
+            computed = computed.derive(n)
+        return computed
+
+def getTextAlign(node):
+    """same as styleutils.getTextAlign"""
+    align = getComputedStyle(node).text_align
+    if align == 'none':
+        return styleutils.getBaseAlign(node)
+    return align
@@ -6,23 +6,61 @@
 
 import string 
 import re
+from bisect import bisect_right
+from copy import copy
 import urllib
 import urlparse
 
 from reportlab.platypus.flowables import Flowable, Image, HRFlowable, Preformatted, PageBreak, _listWrapOn, _ContainerSpace, _flowableSublist
 from reportlab.platypus.paragraph import Paragraph, deepcopy, cleanBlockQuotedText
+from reportlab.platypus.xpreformatted import XPreformatted
+from reportlab.lib.enums import TA_LEFT
+from reportlab.graphics import renderPDF
 
 from reportlab.lib.colors import Color
 from mwlib.rl import pdfstyles
 
+class DrawingImage(Flowable):
+    """Vector replacement for platypus Images: draws a reportlab Drawing
+    scaled to drawWidth x drawHeight. The drawing is stored only once per
+    document as a form XObject named form_name."""
+
+    def __init__(self, drawing, form_name, width, height):
+        Flowable.__init__(self)
+        self.drawing = drawing
+        self.form_name = form_name
+        self.drawWidth = width
+        self.drawHeight = height
+
+    def wrap(self, availWidth, availHeight):
+        return self.drawWidth, self.drawHeight
+
+    def draw(self):
+        canv = self.canv
+        d = self.drawing
+        if not canv.hasForm(self.form_name):
+            canv.beginForm(self.form_name, 0, 0, d.width, d.height)
+            renderPDF.draw(d, canv, 0, 0, showBoundary=False)
+            canv.endForm()
+        canv.saveState()
+        canv.scale(self.drawWidth/float(d.width), self.drawHeight/float(d.height))
+        canv.doForm(self.form_name)
+        canv.restoreState()
+
+
 class Figure(Flowable):
 
-    def __init__(self,imgFile, captionTxt, captionStyle, imgWidth=None, imgHeight=None, margin=(0,0,0,0), padding=(0,0,0,0), align=None, borderColor=(0.75,0.75,0.75), no_mask=False, url=None):
+    def __init__(self,imgFile, captionTxt, captionStyle, imgWidth=None, imgHeight=None, margin=(0,0,0,0), padding=(0,0,0,0), align=None, borderColor=(0.75,0.75,0.75), no_mask=False, url=None, image_cache=None, drawing=None):
         imgFile = imgFile 
         self.imgPath = imgFile
+        self.no_mask = no_mask
+        self.image_cache = image_cache # used to resample the image for pdfstyles.img_target_dpi
+        self.drawing = drawing # (form name, reportlab drawing) to use instead of the image file
         # workaround for http://code.pediapress.com/wiki/ticket/324
         # see http://two.pairlist.net/pipermail/reportlab-users/2008-October/007526.html
-        if no_mask:
+        if drawing:
+            self.i = DrawingImage(drawing[1], drawing[0], imgWidth, imgHeight)
+        elif no_mask:
             self.i = Image(imgFile, width=imgWidth, height=imgHeight, mask=None)
         else:
             self.i = Image(imgFile, width=imgWidth, height=imgHeight)
@@ -39,6 +77,17 @@ class Figure(Flowable):
         self.availHeight = None
         self.url = url
 
+    def _resampleImage(self):
+        # the draw size is final now: embed a copy with the target resolution
+        w, h = self.i.drawWidth, self.i.drawHeight
+        path = self.image_cache.fitImage(self.imgPath, w, h, pdfstyles.img_target_dpi, recompress=True)
+        if path == self.imgPath:
+            return
+        if self.no_mask:
+            self.i = Image(path, width=w, height=h, mask=None)
+        else:
+            self.i = Image(path, width=w, height=h)
+
     def draw(self):
         canv = self.canv
         if self.align == "center":
@@ -51,6 +100,8 @@ class Figure(Flowable):
         self.c.canv = canv
         self.c.draw()
         canv.translate( (self.boxWidth - self.padding[1] - self.padding[3] - self.i.drawWidth)/2, self.captionHeight +2)
+        if self.image_cache and pdfstyles.img_target_dpi and not self.drawing:
+            self._resampleImage()
         self.i.canv = canv
         self.i.draw()
         if self.url:
@@ -309,6 +360,126 @@ class PreformattedBox(Preformatted):
                 PreformattedBox(text2, style, margin=self.margin, padding=self.padding, borderwidth=self.borderwidth)]  
 
 
+def _linePiece(flowable, start, stop):
+    """shallow copy of a line based flowable showing the lines start:stop"""
+    piece = copy(flowable)
+    for attr in ('_postponed', 'canv', '_frame'): # layout state of the original
+        piece.__dict__.pop(attr, None)
+    piece._start = start
+    piece._stop = stop
+    if start and piece.style.firstLineIndent != 0:
+        piece.style = deepcopy(piece.style)
+        piece.style.firstLineIndent = 0
+    return piece
+
+
+class LinePreformatted(XPreformatted):
+    """XPreformatted which is broken into lines only once.
+
+    Splitting does not re-parse the text: all pieces share the line array
+    of the original flowable and only store the range of lines they
+    display. Optionally a border is drawn around the text like in
+    PreformattedBox.
+    """
+
+    def __init__(self, text, style, margin=0, padding=0, borderwidth=0, **kwargs):
+        XPreformatted.__init__(self, text, style, **kwargs)
+        self.margin = margin
+        self.padding = padding
+        self.borderwidth = borderwidth
+        self._lines = None
+        self._start = 0
+        self._stop = 0
+
+    def _breakLines(self, availWidth, availHeight):
+        XPreformatted.wrap(self, availWidth, availHeight)
+        blPara = getattr(self, 'blPara', None)
+        if blPara is None:
+            return
+        self._lines = blPara.lines
+        self._stop = len(self._lines)
+        self._breakWidth = availWidth
+        style = self.style
+        if blPara.kind == 0:
+            widths = [l[2] for l in self._lines]
+        else:
+            widths = [l.currentWidth for l in self._lines]
+        self._contentWidth = max(widths or [0]) + style.leftIndent + style.rightIndent
+        leading = style.leading
+        autoLeading = getattr(self,'autoLeading',getattr(style,'autoLeading',''))
+        if blPara.kind == 0:
+            if autoLeading == 'max':
+                leading = max(leading, blPara.ascent-blPara.descent)
+            elif autoLeading == 'min':
+                leading = blPara.ascent-blPara.descent
+            heights = [leading] * self._stop
+        elif autoLeading == 'max':
+            heights = [max(l.ascent-l.descent, leading) for l in self._lines]
+        elif autoLeading == 'min':
+            heights = [l.ascent-l.descent for l in self._lines]
+        else:
+            heights = [leading] * self._stop
+        # offsets[i] is the distance between the top of the text and line i
+        offsets = [0]
+        for h in heights:
+            offsets.append(offsets[-1] + h)
+        self._offsets = offsets
+
+    def _extra(self):
+        return self.margin+self.borderwidth+self.padding*2
+
+    def wrap(self, availWidth, availHeight):
+        if self._lines is None:
+            self._breakLines(availWidth, availHeight)
+            if self._lines is None:
+                return 0, 0x7fffffff
+        self._availWidth = availWidth
+        self.width = max(availWidth, self._contentWidth)
+        self.height = self._offsets[self._stop] - self._offsets[self._start]
+        return (self.width+self._extra(), self.height+self._extra())
+
+    def split(self, availWidth, availHeight):
+        if self._lines is None:
+            self.wrap(availWidth, availHeight)
+            if self._lines is None:
+                return []
+        top = self._offsets[self._start]
+        stop = bisect_right(self._offsets, top+availHeight-self._extra()+1e-6, self._start, self._stop+1) - 1
+        if stop <= self._start:
+            return []
+        if stop >= self._stop:
+            return [self]
+        return [_linePiece(self, self._start, stop),
+                _linePiece(self, stop, self._stop)]
+
+    def _pieceLines(self):
+        lines = self._lines[self._start:self._stop]
+        style = self.style
+        if style.alignment == TA_LEFT or self._availWidth == self._breakWidth:
+            return lines
+        # the free space of each line depends on the width the lines are drawn with
+        maxWidth = self._availWidth - style.leftIndent - style.rightIndent
+        if self.blPara.kind == 0:
+            return [(maxWidth-l[2], l[1], l[2]) for l in lines]
+        return [l.clone(extraSpace=maxWidth-l.currentWidth) for l in lines]
+
+    def draw(self):
+        blPara = self.blPara
+        self.blPara = blPara.clone(lines=self._pieceLines())
+        canv = self.canv
+        canv.saveState()
+        try:
+            if self.borderwidth:
+                canv.setLineWidth(self.borderwidth)
+                canv.translate(0,self.margin)
+                canv.rect(0,0,self.width+self.padding*2, self.height+self.padding*2)
+                canv.translate(self.padding, self.padding)
+            XPreformatted.draw(self)
+        finally:
+            canv.restoreState()
+            self.blPara = blPara
+
+
 class SmartKeepTogether(_ContainerSpace, Flowable):
 
     def __init__(self,flowables,maxHeight=None):
@@ -19,31 +19,40 @@ except ImportError:
 #     'doc_key': 'font-weight: bold; display: inline;', 
 #     }
 
+def _compileStyles(styles):
+    compiled = []
+    for style in styles.split(';'):
+        try:
+            style_name, style_val = style.split(':', 1)
+        except ValueError:
+            continue
+        compiled.append((style_name.strip(), style_val.strip()))
+    return compiled
+
+
 class CustomNodeTransformer(object):
 
     def __init__(self):
-        pass
+        # css_map with the style strings split into (name, value) pairs
+        self.compiled_css_map = dict((node_class, _compileStyles(styles))
+                                     for node_class, styles in css_map.items())
 
     def _updateStyles(self, node, styles):
         node_style = node.vlist.get('style', {})
-        for style in styles.split(';'):
-            try:
-                style_name, style_val = style.split(':', 1)
-            except ValueError:
-                continue
-            node_style[style_name.strip()] = style_val.strip()
+        node_style.update(styles)
         node.vlist['style'] = node_style
 
         
+    def transformNodeCSS(self, node):
+        """apply the css_map to node, but not to its children"""
+        vlist = getattr(node, 'vlist', None)
+        if not vlist or 'class' not in vlist:
+            return
+        for node_class in vlist['class'].split():
+            if node_class in self.compiled_css_map:
+                self._updateStyles(node, self.compiled_css_map[node_class])
+
     def transformCSS(self, node):
-        if getattr(node, 'vlist', None) == None:
-            node_classes = []
-        else:
-            node_classes = node.vlist.get('class', '').split()
-
-        for node_class in node_classes:
-            if node_class in css_map:
-                self._updateStyles(node, css_map[node_class])        
-                
+        self.transformNodeCSS(node)
         for c in node.children:
             self.transformCSS(c)
@@ -0,0 +1,80 @@
+#! /usr/bin/env python
+#! -*- coding:utf-8 -*-
+
+# Copyright (c) 2007, PediaPress GmbH
+# See README.txt for additional licensing information.
+
+import os
+import tempfile
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from mwlib import log
+
+log = log.Log('rlwriter')
+
+
+class DiskCache(object):
+    """File based cache that can be shared by several rendering jobs.
+
+    Entries are stored below <cachedir>/<namespace>/ and are spread over
+    subdirectories like the entries of the math cache. Entries are
+    written to a temporary file first and then renamed, so concurrent
+    jobs never see partially written entries.
+    """
+
+    def __init__(self, cachedir, namespace):
+        self.basedir = os.path.join(cachedir, namespace)
+
+    @staticmethod
+    def makeKey(*parts):
+        m = md5()
+        for part in parts:
+            if isinstance(part, unicode):
+                part = part.encode('utf-8')
+            elif not isinstance(part, str):
+                part = repr(part)
+            m.update(part)
+            m.update('\0')
+        return m.hexdigest()
+
+    def getPath(self, key, suffix=''):
+        return os.path.join(self.basedir, key[0], key[1], key + suffix)
+
+    def get(self, key, suffix=''):
+        try:
+            f = open(self.getPath(key, suffix), 'rb')
+        except IOError:
+            return None
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def set(self, key, data, suffix=''):
+        path = self.getPath(key, suffix)
+        dirname = os.path.dirname(path)
+        tmp_path = None
+        try:
+            if not os.path.isdir(dirname):
+                try:
+                    os.makedirs(dirname)
+                except OSError:
+                    if not os.path.isdir(dirname): # not created by a concurrent job
+                        raise
+            fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(tmp_path, path)
+        except (IOError, OSError), exc:
+            log.warning('could not write cache entry %r: %s' % (path, exc))
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return None
+        return path
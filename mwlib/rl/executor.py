@@ -0,0 +1,228 @@
+#! /usr/bin/env python
+#! -*- coding:utf-8 -*-
+
+# Copyright (c) 2007, PediaPress GmbH
+# See README.txt for additional licensing information.
+
+import os
+import re
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from mwlib import log
+from mwlib.rl import pdfstyles
+
+log = log.Log('rlwriter')
+
+
+class ToolSlots(object):
+    """At most max_procs slots per tool for all processes on this host.
+
+    A slot is an flock'ed file <tool>.<n>.lock in a directory shared by
+    the processes. The kernel releases the lock when the holder exits,
+    so slots of crashed jobs do not leak. flock locks belong to an open
+    file, i.e. threads of one process also exclude each other.
+    """
+
+    def __init__(self, directory, tool, max_procs):
+        name = re.sub(r'[^\w.-]', '_', tool)
+        self.paths = [os.path.join(directory, '%s.%d.lock' % (name, i)) for i in range(max_procs)]
+
+    def acquire(self):
+        delay = 0.001
+        while True:
+            for path in self.paths:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except IOError: # held by another process or thread
+                    os.close(fd)
+            time.sleep(delay)
+            delay = min(2*delay, 0.05)
+
+    def release(self, fd):
+        os.close(fd) # also releases the lock
+
+
+class ThreadSlots(object):
+    """fallback if there is no flock: the limit only holds per process"""
+
+    def __init__(self, max_procs):
+        self.semaphore = threading.Semaphore(max_procs)
+
+    def acquire(self):
+        self.semaphore.acquire()
+
+    def release(self, token):
+        self.semaphore.release()
+
+
+def _getSlotDir():
+    directory = pdfstyles.tool_slot_dir
+    if not directory:
+        uid = getattr(os, 'getuid', lambda: 0)()
+        directory = os.path.join(tempfile.gettempdir(), 'mwlib-rl-tools-%d' % uid)
+    try:
+        os.makedirs(directory, 0700)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+    return directory
+
+
+class ToolStats(object):
+
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def __str__(self):
+        return '%d runs, %d failures, %d timeouts, %.2fs total, %.2fs max' % (
+            self.runs, self.failures, self.timeouts, self.total_time, self.max_time)
+
+
+def _limitChild(cpu_time):
+    def preexec():
+        os.setsid() # own process group: killing it also kills helpers started by the tool
+        if resource is not None and cpu_time:
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_time, cpu_time + 1))
+    return preexec
+
+
+class Executor(object):
+    """Runs external tools like convert, texvc and pdftk.
+
+    The number of concurrent processes per tool is limited for all
+    render processes that share pdfstyles.tool_slot_dir (see ToolSlots)
+    and every process is killed (with its whole process group) when it
+    exceeds its wall clock time. The CPU time is limited by an rlimit.
+    Limits are configured per tool in pdfstyles.tool_limits. Statistics
+    are collected per process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slots = {}
+        self.stats = {}
+        self.slot_dir = None
+
+    def getLimits(self, tool):
+        return pdfstyles.tool_limits.get(tool, pdfstyles.tool_default_limits)
+
+    def _getToolState(self, tool, max_procs):
+        self.lock.acquire()
+        try:
+            if tool not in self.slots:
+                self.slots[tool] = self._makeSlots(tool, max_procs)
+                self.stats[tool] = ToolStats()
+            return self.slots[tool], self.stats[tool]
+        finally:
+            self.lock.release()
+
+    def _makeSlots(self, tool, max_procs):
+        if fcntl is not None:
+            try:
+                if self.slot_dir is None:
+                    self.slot_dir = _getSlotDir()
+                return ToolSlots(self.slot_dir, tool, max_procs)
+            except OSError, exc:
+                log.warning('no tool slot directory, limits only hold per process: %s' % exc)
+        return ThreadSlots(max_procs)
+
+    def run(self, cmd, tool=None, quiet=False):
+        """Run cmd (a list of arguments) and return (returncode, stdout).
+        Processes that time out are killed, their return code is
+        negative like the one of any killed process. OSError is raised
+        if the tool can not be started. If quiet is set, stderr is
+        captured and only logged if the tool fails."""
+        tool = tool or os.path.basename(cmd[0])
+        max_procs, timeout, cpu_time = self.getLimits(tool)
+        slots, stats = self._getToolState(tool, max_procs)
+        slot = slots.acquire()
+        try:
+            start = time.time()
+            out = tempfile.TemporaryFile() # a pipe could fill up while we are waiting
+            err = tempfile.TemporaryFile() if quiet else None
+            devnull = open(os.devnull, 'rb')
+            try:
+                try:
+                    p = subprocess.Popen(cmd, stdin=devnull, stdout=out, stderr=err, close_fds=True,
+                                         preexec_fn=_limitChild(cpu_time))
+                except OSError:
+                    self._count(stats, time.time() - start, False, True)
+                    raise
+                timed_out = self._wait(p, timeout)
+                out.seek(0)
+                output = out.read()
+                if err is not None:
+                    err.seek(0)
+                    error = err.read()
+            finally:
+                devnull.close()
+                out.close()
+                if err is not None:
+                    err.close()
+        finally:
+            slots.release(slot)
+        elapsed = time.time() - start
+        self._count(stats, elapsed, timed_out, p.returncode != 0)
+        if timed_out:
+            log.warning('%s killed after %.1fs: %r' % (tool, elapsed, cmd))
+        elif quiet and p.returncode != 0 and error:
+            log.warning('%s failed (return code %d): %r' % (tool, p.returncode, error))
+        return p.returncode, output
+
+    def _count(self, stats, elapsed, timed_out, failed):
+        self.lock.acquire()
+        try:
+            stats.runs += 1
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+            if timed_out:
+                stats.timeouts += 1
+            if failed:
+                stats.failures += 1
+        finally:
+            self.lock.release()
+
+    def _wait(self, p, timeout):
+        """wait for p, a watchdog kills its process group after timeout seconds"""
+        killed = []
+        def kill():
+            killed.append(True)
+            try:
+                os.killpg(p.pid, signal.SIGKILL)
+            except OSError: # exited in the meantime
+                pass
+        watchdog = threading.Timer(timeout, kill)
+        watchdog.start()
+        try:
+            p.wait()
+        finally:
+            watchdog.cancel()
+        return bool(killed)
+
+    def getStats(self):
+        return '\n'.join('%s: %s' % (tool, stats) for tool, stats in sorted(self.stats.items()))
+
+
+# shared by all writers of a process. The limits hold for all processes
+# using the same tool_slot_dir, the statistics are per process.
+executor = Executor()
@@ -7,6 +7,7 @@
 from xml.sax.saxutils import escape as xmlescape
 
 from mwlib.writer.formatter import Formatter
+from mwlib.writer import styleutils
 from mwlib.rl import pdfstyles
 
 class RLFormatter(Formatter):
@@ -43,3 +44,56 @@ class RLFormatter(Formatter):
     def color_str(self):
         return '#' + ''.join(['%2.2x' % int(c*255) for c in self.color_style])
 
+    font_size_names = {'xx-small': 0.5,
+                       'x-small': 0.75,
+                       'small': 1.0,
+                       'medium': 1.25,
+                       'large': 1.5,
+                       'x-large': 1.75,
+                       'xx-large': 1.75,
+                       }
+
+    def _relativeFontSize(self, font_style):
+        # same rules as Formatter.checkFontSize
+        if not font_style:
+            return None
+        size, unit = styleutils.parseLength(font_style)
+        if size and unit in ['%', 'pt', 'px', 'em']:
+            return {'%': size/100.0, 'pt': size/10.0, 'px': size/12.0, 'em': size}[unit]
+        return self.font_size_names.get(font_style)
+
+    def compileCssStyle(self, node):
+        """Return the changes changeCssStyle makes for node as a list of
+        (action, render style, value), so that the css of a node is only
+        evaluated once. See setCompiledStyle."""
+        css = self.css_style_map
+        ops = []
+        for node_style, style_value in node.style.items():
+            if node_style in css:
+                for render_style, action in css[node_style].get(style_value, []):
+                    if action in ('change', 'reset'):
+                        ops.append((action, render_style, None))
+                if css[node_style].keys() == ['*']:
+                    attr_name, method = css[node_style]['*']
+                    val = method(node)
+                    if val:
+                        ops.append(('set', attr_name, val))
+        rel_font_size = self._relativeFontSize(node.style.get('font-size'))
+        if rel_font_size is not None:
+            ops.append(('font_size', None, rel_font_size))
+        return tuple(ops)
+
+    def setCompiledStyle(self, node, css_ops):
+        """like setStyle, with the css of node compiled by compileCssStyle"""
+        current_styles = self.getCurrentStyles()
+        self.changeNodeStyle(node)
+        for action, render_style, val in css_ops:
+            if action == 'change':
+                setattr(self, render_style, getattr(self, render_style) + 1)
+            elif action == 'reset':
+                setattr(self, render_style, 0)
+            elif action == 'set':
+                setattr(self, render_style, val)
+            else:
+                self.setRelativeFontSize(val)
+        return current_styles
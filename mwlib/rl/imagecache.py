@@ -0,0 +1,189 @@
+#! /usr/bin/env python
+#! -*- coding:utf-8 -*-
+
+# Copyright (c) 2007, PediaPress GmbH
+# See README.txt for additional licensing information.
+
+import os
+from cStringIO import StringIO
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from PIL import Image as PilImage
+
+from mwlib import log
+from mwlib.rl.diskcache import DiskCache
+
+log = log.Log('rlwriter')
+
+# content hashes of image files by (path, size, mtime). images like the
+# cover are used by many jobs and are not hashed again for each of them
+_content_hashes = {}
+
+def contentHash(path):
+    st = os.stat(path)
+    fingerprint = (os.path.abspath(path), st.st_size, st.st_mtime)
+    digest = _content_hashes.get(fingerprint)
+    if digest is None:
+        m = md5()
+        f = open(path, 'rb')
+        try:
+            while True:
+                data = f.read(1<<16)
+                if not data:
+                    break
+                m.update(data)
+        finally:
+            f.close()
+        digest = _content_hashes[fingerprint] = m.hexdigest()
+    return digest
+
+
+def hasAlpha(img):
+    # besides palette images, RGB and L PNGs can have a transparent color (tRNS)
+    return img.mode in ('RGBA', 'LA') or 'transparency' in img.info
+
+
+class ImageInfo(object):
+    """what is known about an image without decoding its pixel data"""
+
+    def __init__(self, img):
+        self.size = img.size
+        self.mode = img.mode
+        self.format = img.format
+        self.interlaced = img.info.get('interlace', 0) == 1
+        self.transparency = img.info.get('transparency')
+        self.has_alpha = hasAlpha(img)
+
+
+class ImageInfoIndex(object):
+    """Sizes, modes etc. of the images used by a rendering job.
+
+    Only the image headers are read, once per file. Entries are keyed
+    by (path, size, mtime) so files that are modified in place (see
+    RlWriter._fixBrokenImages) are read again.
+    """
+
+    def __init__(self):
+        self.infos = {}
+
+    def getInfo(self, path):
+        """Return the ImageInfo for path. Raises IOError if the file can
+        not be read or is no image PIL knows about."""
+        st = os.stat(path)
+        fingerprint = (path, st.st_size, st.st_mtime)
+        info = self.infos.get(fingerprint)
+        if info is None:
+            info = self.infos[fingerprint] = ImageInfo(PilImage.open(path))
+        return info
+
+    def getSize(self, path):
+        return self.getInfo(path).size
+
+
+class ImageCache(object):
+    """Downscaled copies of images, stored in a DiskCache.
+
+    Images are only ever scaled down. Photographic images are stored as
+    JPEG, drawings and images with transparency as PNG. Copies are keyed by the content of
+    the original image, their pixel size and the encoding parameters, so
+    a cache directory can be shared by several rendering jobs.
+    """
+
+    def __init__(self, cachedir, jpeg_quality=85):
+        self.cache = DiskCache(cachedir, 'images')
+        self.jpeg_quality = jpeg_quality
+        self._unchanged = set() # keys of images that are best left as they are
+
+    def fitImage(self, path, max_width, max_height, dpi, recompress=False):
+        """Return the path of a copy of the image at path that fits into
+        max_width x max_height points at the given resolution. The
+        original path is returned if the image is small enough already
+        or if it can not be handled. If recompress is set, photographic
+        images are stored as JPEG even if they need not be scaled."""
+        try:
+            img = PilImage.open(path) # only reads the header
+            width, height = img.size
+            scale = min(max_width*dpi/72.0/width, max_height*dpi/72.0/height)
+            if scale < 1:
+                size = (max(1, int(round(width*scale))), max(1, int(round(height*scale))))
+            elif recompress and img.format != 'JPEG' and not hasAlpha(img):
+                size = img.size
+            else:
+                return path
+            return self._getResized(path, img, size)
+        except (IOError, OSError, ValueError), exc:
+            log.warning('could not resample image %r: %s' % (path, exc))
+            return path
+
+    def _getResized(self, path, img, size):
+        key = self.cache.makeKey(contentHash(path), size, self.jpeg_quality)
+        if key in self._unchanged:
+            return path
+        for suffix in ('.jpg', '.png'):
+            cached_path = self.cache.getPath(key, suffix)
+            if os.path.exists(cached_path):
+                return cached_path
+        if hasAlpha(img):
+            fmt, mode = 'PNG', 'RGBA'
+        else:
+            mode = 'L' if img.mode in ('1', 'L') else 'RGB'
+            if img.format == 'JPEG':
+                fmt = 'JPEG'
+                img.draft(mode, size) # let the decoder do most of the downscaling
+            elif img.getcolors(256) is None: # photographic, i.e. lots of colors
+                fmt = 'JPEG'
+            else: # drawings and diagrams would suffer from JPEG artifacts
+                fmt = 'PNG'
+        if fmt == 'PNG' and size == img.size:
+            self._unchanged.add(key)
+            return path
+        if img.mode != mode:
+            img = img.convert(mode)
+        if img.size != size:
+            img = img.resize(size, PilImage.ANTIALIAS)
+        data = StringIO()
+        if fmt == 'JPEG':
+            img.save(data, fmt, quality=self.jpeg_quality)
+            suffix = '.jpg'
+        else:
+            img.save(data, fmt, optimize=True)
+            suffix = '.png'
+        return self.cache.set(key, data.getvalue(), suffix) or path
+
+
+class ImageRegistry(object):
+    """Book wide registry of the images placed in a document.
+
+    The same image is often delivered under different paths (e.g. icons
+    and flags used by many articles). All paths with identical content
+    are mapped to the path under which the content was first seen.
+    Reportlab embeds images drawn from the same file only once, so each
+    distinct image ends up as a single XObject in the PDF.
+    """
+
+    def __init__(self):
+        self.paths = {} # content hash -> canonical path
+        self.aliases = {} # path -> canonical path
+        self.references = 0
+        self.bytes_saved = 0
+
+    def canonicalPath(self, path):
+        self.references += 1
+        canonical = self.aliases.get(path)
+        if canonical is None:
+            try:
+                digest = contentHash(path)
+            except (IOError, OSError):
+                return path
+            canonical = self.aliases[path] = self.paths.setdefault(digest, path)
+            if canonical != path: # would have been embedded a second time
+                self.bytes_saved += os.path.getsize(path)
+        return canonical
+
+    def getStats(self):
+        return 'images: %d unique, %d paths, %d references, %d bytes saved by deduplication' % (
+            len(self.paths), len(self.aliases), self.references, self.bytes_saved)
@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+#! -*- coding:utf-8 -*-
+
+# Copyright (c) 2007, PediaPress GmbH
+# See README.txt for additional licensing information.
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from mwlib import log
+
+log = log.Log('rlwriter')
+
+
+class ImageMetaIndex(object):
+    """Metadata of the images of an image DB (usually the one of a
+    collection): image info, description URLs and contributors.
+
+    The image info of all images is read in one sweep when the index is
+    created. URLs and contributors are looked up once per image and then
+    kept for the whole job.
+    """
+
+    def __init__(self, image_db):
+        self.image_db = image_db
+        self.infos = self._readImageInfos()
+        self.urls = {}
+        self.contributors = {}
+
+    def _readImageInfos(self):
+        imageinfo = getattr(self.image_db, 'imageinfo', None)
+        infos = {}
+        try:
+            items = imageinfo.items()
+        except AttributeError:
+            return infos
+        for name, info in items:
+            if isinstance(name, str):
+                name = unicode(name, 'utf-8', 'replace')
+            if isinstance(info, basestring): # nuwiki stores the info as json
+                try:
+                    info = json.loads(info)
+                except ValueError:
+                    log.warning('bad image info for %r' % name)
+                    continue
+            infos[name] = info or {}
+        return infos
+
+    def getImageInfo(self, name):
+        info = self.infos.get(name)
+        if info is None: # keys not found by the sweep, e.g. differently normalized names
+            imageinfo = getattr(self.image_db, 'imageinfo', None)
+            info = self.infos[name] = (imageinfo.get(name, {}) if imageinfo is not None else {}) or {}
+        return info
+
+    def getURL(self, name):
+        """the URL of the description page of the image or, if that is not
+        known, the URL of the image"""
+        try:
+            return self.urls[name]
+        except KeyError:
+            url = self.urls[name] = self.image_db.getDescriptionURL(name) or self.image_db.getURL(name)
+            return url
+
+    def getContributors(self, name):
+        try:
+            return self.contributors[name]
+        except KeyError:
+            contributors = self.contributors[name] = self.image_db.getContributors(name)
+            return contributors
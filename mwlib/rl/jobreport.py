@@ -0,0 +1,119 @@
+#! /usr/bin/env python
+#! -*- coding:utf-8 -*-
+
+# Copyright (c) 2007, PediaPress GmbH
+# See README.txt for additional licensing information.
+
+import time
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    from mwlib import linuxmem
+except ImportError:
+    linuxmem = None
+
+
+def _memory():
+    if linuxmem:
+        return linuxmem.memory()
+    return None
+
+
+class JobReport(object):
+    """Wall time and memory usage (MB RSS, if available) of the phases of
+    a rendering job, in total and per article.
+
+    Phases can be nested: 'images' and 'math' are part of 'layout'.
+    If timed is False, only the counters are kept. While suspended is
+    set, nothing is counted or timed (e.g. while an article is rendered
+    a second time).
+    """
+
+    counter_names = ('images', 'formulas', 'tables')
+
+    def __init__(self, timed=True):
+        self.timed = timed
+        self.suspended = False
+        self.start = time.time()
+        self.attempts = 0 # > 1 if the book was rendered again in fail safe mode
+        self.phases = {} # phase -> {'calls', 'time', 'max_rss'}
+        self.counters = dict((name, 0) for name in self.counter_names)
+        self.articles = []
+        self.article = None
+        self.pages = None
+
+    def newAttempt(self):
+        self.attempts += 1
+        self.counters = dict((name, 0) for name in self.counter_names)
+        self.articles = []
+
+    def startArticle(self, title):
+        self.article = {'title': title, 'phases': {}, 'pages': None, 'skipped': False}
+        self.article.update((name, 0) for name in self.counter_names)
+        self.articles.append(self.article)
+
+    def endArticle(self):
+        self.article = None
+
+    def startPhase(self, phase):
+        if not self.timed or self.suspended:
+            return None
+        return (phase, time.time())
+
+    def endPhase(self, token):
+        if token is None:
+            return
+        phase, start = token
+        elapsed = time.time() - start
+        rss = _memory()
+        stats = self.phases.setdefault(phase, {'calls': 0, 'time': 0.0, 'max_rss': None})
+        stats['calls'] += 1
+        stats['time'] += elapsed
+        if rss is not None:
+            stats['max_rss'] = max(stats['max_rss'], rss)
+        if self.article is not None:
+            self.article['phases'][phase] = self.article['phases'].get(phase, 0.0) + elapsed
+            if rss is not None:
+                self.article['rss'] = rss
+
+    def count(self, name):
+        if self.suspended:
+            return
+        self.counters[name] += 1
+        if self.article is not None:
+            self.article[name] += 1
+
+    def setPages(self, pages, toc_entries):
+        """toc_entries: (level, title, first page) of everything in the TOC.
+        The articles of the book are the first article entries."""
+        self.pages = pages
+        starts = [entry[2] for entry in toc_entries]
+        article_starts = [entry[2] for entry in toc_entries if entry[0] == 'article']
+        rendered = [article for article in self.articles if not article['skipped']]
+        if len(article_starts) < len(rendered):
+            return # no TOC was collected
+        for article, first_page in zip(rendered, article_starts):
+            later = [p for p in starts if p > first_page] + [pages + 1]
+            article['pages'] = min(later) - first_page
+
+    def asDict(self):
+        return {
+            'time': time.time() - self.start,
+            'attempts': self.attempts,
+            'rss': _memory(),
+            'pages': self.pages,
+            'phases': self.phases,
+            'counters': self.counters,
+            'articles': self.articles,
+            }
+
+    def write(self, path):
+        f = open(path, 'wb')
+        try:
+            json.dump(self.asDict(), f, indent=1, sort_keys=True)
+        finally:
+            f.close()
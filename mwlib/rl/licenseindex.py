@@ -0,0 +1,39 @@
+#! /usr/bin/env python
+#! -*- coding:utf-8 -*-
+
+# Copyright (c) 2007, PediaPress GmbH
+# See README.txt for additional licensing information.
+
+import threading
+
+from mwlib.writer.licensechecker import LicenseChecker
+
+
+class LicenseIndex(dict):
+    """Read-only mapping of lower case license template names to
+    licensechecker.License objects."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('LicenseIndex is read-only')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+
+_indexes = {} # csv file name -> LicenseIndex
+_lock = threading.Lock()
+
+def getLicenseIndex(fn=None):
+    """Return the licenses of the license table fn (default: the one
+    shipped with mwlib). Each table is read once per process, when it is
+    first needed, and the index is shared by all writers. Pre-forking
+    servers can call this before forking, so that all workers share it."""
+    _lock.acquire()
+    try:
+        index = _indexes.get(fn)
+        if index is None:
+            checker = LicenseChecker()
+            checker.readLicensesCSV(fn)
+            index = _indexes[fn] = LicenseIndex(checker.licenses)
+        return index
+    finally:
+        _lock.release()
@@ -0,0 +1,74 @@
+#! /usr/bin/env python
+#! -*- coding:utf-8 -*-
+
+# Copyright (c) 2007, PediaPress GmbH
+# See README.txt for additional licensing information.
+
+import threading
+
+try:
+    from collections import OrderedDict
+except ImportError: # python < 2.7
+    OrderedDict = None
+
+
+class LRUCache(object):
+    """Dictionary with at most maxsize entries. When it is full, the least
+    recently used entry is dropped. Can be shared by threads."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.data = OrderedDict() if OrderedDict else {}
+        self.order = [] if OrderedDict is None else None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        self.lock.acquire()
+        try:
+            try:
+                value = self.data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.data[key] = value # most recently used entries are last
+            if self.order is not None:
+                self.order.remove(key)
+                self.order.append(key)
+            return value
+        finally:
+            self.lock.release()
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self.lock.acquire()
+        try:
+            if key in self.data:
+                del self.data[key]
+                if self.order is not None:
+                    self.order.remove(key)
+            elif len(self.data) >= self.maxsize:
+                if self.order is not None:
+                    del self.data[self.order.pop(0)]
+                else:
+                    self.data.popitem(last=False)
+            self.data[key] = value
+            if self.order is not None:
+                self.order.append(key)
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.data.clear()
+            if self.order is not None:
+                del self.order[:]
+        finally:
+            self.lock.release()
@@ -0,0 +1,49 @@
+#! /usr/bin/env python
+#! -*- coding:utf-8 -*-
+
+# Copyright (c) 2007, PediaPress GmbH
+# See README.txt for additional licensing information.
+
+from mwlib import advtree
+
+
+class AncestorContext(object):
+    """The enclosing nodes of a node the writer asks about: the article,
+    the cells and tables (outermost first, like getParentNodesByClass)
+    and whether the node is centered.
+
+    Contexts are immutable. All nodes with the same enclosing article,
+    cells, tables and center share one context object.
+    """
+
+    def __init__(self, article=None, cells=(), tables=(), centered=False):
+        self.article = article
+        self.cells = cells
+        self.tables = tables
+        self.centered = centered
+
+    def enter(self, node):
+        """context of the children of node"""
+        cls = node.__class__
+        if cls == advtree.Article:
+            return AncestorContext(node, self.cells, self.tables, self.centered)
+        if cls == advtree.Cell:
+            return AncestorContext(self.article, self.cells + (node,), self.tables, self.centered)
+        if cls == advtree.Table:
+            return AncestorContext(self.article, self.cells, self.tables + (node,), self.centered)
+        if cls == advtree.Center and not self.centered:
+            return AncestorContext(self.article, self.cells, self.tables, True)
+        return self
+
+
+_root_context = AncestorContext()
+
+def getContext(node):
+    """the context stored by RlWriter.prepareWrite or the one built from the parents of node"""
+    try:
+        return node._context
+    except AttributeError:
+        context = _root_context
+        for parent in node.getParents():
+            context = context.enter(parent)
+        return context
@@ -0,0 +1,69 @@
+#! /usr/bin/env python
+#! -*- coding:utf-8 -*-
+
+# Copyright (c) 2007, PediaPress GmbH
+# See README.txt for additional licensing information.
+
+import time
+
+
+class NodeTimer(object):
+    """Time spent in RlWriter.write per node class and article.
+
+    Inclusive time contains the time of all child nodes, exclusive time
+    does not. For nested nodes of the same class (e.g. tables in tables)
+    only the outermost one adds to the inclusive time. Exclusive times
+    are also collected per stack of node classes, for flame graphs.
+    """
+
+    def __init__(self):
+        self.article = '(book)' # title page etc.
+        self.stack = [] # [node class, start time, time of children]
+        self.active = {} # node class -> number of entries on the stack
+        self.stats = {} # (article, node class) -> [calls, inclusive time, exclusive time]
+        self.stacks = {} # collapsed stack -> exclusive time
+
+    def setArticle(self, title):
+        self.article = title.replace(';', ',')
+
+    def enter(self, name):
+        self.stack.append([name, time.time(), 0.0])
+        self.active[name] = self.active.get(name, 0) + 1
+
+    def leave(self):
+        elapsed = time.time() - self.stack[-1][1]
+        name, start, children = self.stack.pop()
+        if self.stack:
+            self.stack[-1][2] += elapsed
+        exclusive = elapsed - children
+        self.active[name] -= 1
+        stats = self.stats.get((self.article, name))
+        if stats is None:
+            stats = self.stats[(self.article, name)] = [0, 0.0, 0.0]
+        stats[0] += 1
+        if not self.active[name]:
+            stats[1] += elapsed
+        stats[2] += exclusive
+        key = ';'.join([self.article] + [frame[0] for frame in self.stack] + [name])
+        self.stacks[key] = self.stacks.get(key, 0.0) + exclusive
+
+    def getTable(self):
+        """tab separated lines, sorted by exclusive time"""
+        rows = sorted(((excl, incl, calls, name, article)
+                       for (article, name), (calls, incl, excl) in self.stats.items()), reverse=True)
+        lines = ['exclusive\tinclusive\tcalls\tnode\tarticle']
+        for excl, incl, calls, name, article in rows:
+            lines.append('%.6f\t%.6f\t%d\t%s\t%s' % (excl, incl, calls, name, article))
+        return '\n'.join(lines)
+
+    def getCollapsedStacks(self):
+        """exclusive times in microseconds in the input format of flamegraph.pl"""
+        return '\n'.join('%s %d' % (key, int(t*1e6)) for key, t in sorted(self.stacks.items()))
+
+    def write(self, path):
+        for fn, data in ((path, self.getTable()), (path + '.folded', self.getCollapsedStacks())):
+            f = open(fn, 'wb')
+            try:
+                f.write(data.encode('utf-8') + '\n')
+            finally:
+                f.close()
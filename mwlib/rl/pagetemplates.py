@@ -12,7 +12,7 @@ import locale
 
 from reportlab.platypus.paragraph import Paragraph
 from reportlab.lib.units import cm
-from reportlab.platypus.doctemplate import PageTemplate
+from reportlab.platypus.doctemplate import PageTemplate, ActionFlowable
 from reportlab.platypus.frames import Frame
 from mwlib.rl.pdfstyles import page_margin_left, page_margin_right, page_margin_top, page_margin_bottom
 from mwlib.rl.pdfstyles import page_width, page_height, print_height, print_width
@@ -49,6 +49,12 @@ class SimplePage(PageTemplate):
         PageTemplate.__init__(self, id=id, frames=frames, pagesize=pageSize)
 
 class WikiPage(PageTemplate):
+    """Page template for all article pages.
+
+    The header title is not fixed but taken from doc.page_title which is
+    set through NextPageTitle flowables. The title passed to the
+    constructor is only used if no page title is set.
+    """
 
     def __init__(self,
                  title=None,
@@ -62,58 +68,104 @@ class WikiPage(PageTemplate):
         @type title: unicode
         """
 
-        id = title.encode('utf-8')
+        if id is None:
+            id = title.encode('utf-8') if title is not None else 'WikiPage'
         frames = Frame(page_margin_left,page_margin_bottom, print_width, print_height)
 
         PageTemplate.__init__(self,id=id, frames=frames,onPage=onPage,onPageEnd=onPageEnd,pagesize=pagesize)
 
         self.title = title
         self.rtl = rtl
+        self._headers = {}
 
-    def beforeDrawPage(self,canvas,doc):
-        canvas.setFont(serif_font,10)
+    def _drawRules(self, canvas):
         canvas.setLineWidth(0)
-        #header
         canvas.line(header_margin_hor, page_height - header_margin_vert, page_width - header_margin_hor, page_height - header_margin_vert )
+        canvas.line(footer_margin_hor, footer_margin_vert, page_width - footer_margin_hor, footer_margin_vert )
+
+    def _staticForm(self, canvas):
+        """Return the name of a PDF form XObject with the parts of the page
+        decoration that are the same on all pages: the rules and the
+        footer. The form is drawn once per canvas and then only referenced
+        by the pages."""
+        name = 'WikiPageStatic'
+        if canvas.hasForm(name):
+            return name
+        canvas.beginForm(name)
+        self._drawRules(canvas)
+        canvas.setFont(serif_font,8)
+        p = Paragraph(formatter.cleanText(pagefooter, escape=False), text_style())
+        w,h = p.wrap(page_width - header_margin_hor*2.5, page_height)
+        p.drawOn(canvas, footer_margin_hor, footer_margin_vert - 10 - h)
+        canvas.endForm()
+        return name
+
+    def _getHeader(self, title):
+        p = self._headers.get(title)
+        if p is None:
+            p = Paragraph(title, text_style())
+            p.wrap(page_width - header_margin_hor*2.5, page_height) # add an extra 0.5 margin to have enough space for page number
+            self._headers[title] = p
+        return p
+
+    def afterDrawPage(self,canvas,doc):
+        # the page decoration is drawn when the page is finished: the
+        # title of the first page might only be known after it has begun
+        title = getattr(doc, 'page_title', self.title) or ''
+        rtl = getattr(doc, 'page_rtl', self.rtl)
+        canvas.saveState()
+        canvas.resetTransforms()
+        if pdfstyles.show_page_footer and pagefooter:
+            canvas.doForm(self._staticForm(canvas))
+        else: # referencing a form costs more than drawing two lines
+            self._drawRules(canvas)
         if pdfstyles.show_page_header:
             canvas.saveState()
-            canvas.resetTransforms()
-            if not self.rtl:
+            if not rtl:
                 h_offset = header_margin_hor
             else:
                 h_offset = 1.5*header_margin_hor
             canvas.translate(h_offset, page_height - header_margin_vert - 0.1*cm)
-            p = Paragraph(self.title, text_style())
+            p = self._getHeader(title)
             p.canv = canvas
-            p.wrap(page_width - header_margin_hor*2.5, page_height) # add an extra 0.5 margin to have enough space for page number
             p.drawPara()
+            del p.canv
             canvas.restoreState()
 
-        if not self.rtl:
+        canvas.setFont(serif_font,10)
+        if not rtl:
             h_pos =  page_width - header_margin_hor
             d = canvas.drawRightString
         else:
             h_pos = header_margin_hor
             d = canvas.drawString
         d(h_pos, page_height - header_margin_vert + 0.1 * cm, "%d" % doc.page)
-
-        #Footer
-        canvas.saveState()
-        canvas.setFont(serif_font,8)
-        canvas.line(footer_margin_hor, footer_margin_vert, page_width - footer_margin_hor, footer_margin_vert )
-        if pdfstyles.show_page_footer:
-            p = Paragraph(formatter.cleanText(pagefooter, escape=False), text_style())
-            p.canv = canvas
-            w,h = p.wrap(page_width - header_margin_hor*2.5, page_height)
-            p.drawOn(canvas, footer_margin_hor, footer_margin_vert - 10 - h)
         canvas.restoreState()
 
 
+class NextPageTitle(ActionFlowable):
+    """Switch to the WikiPage template and use the given header title
+    and text direction starting with the next page. This replaces one
+    page template per article."""
+
+    def __init__(self, title, rtl=False, template='WikiPage'):
+        ActionFlowable.__init__(self, ('nextPageTitle', title, rtl))
+        self.template = template
+
+    def apply(self, doc):
+        doc.handle_nextPageTemplate(self.template)
+        title, rtl = self.action[1:]
+        if hasattr(doc, 'handle_nextPageTitle'):
+            doc.handle_nextPageTitle(title, rtl)
+        else: # plain doc templates, e.g. when checking single articles
+            doc.page_title = title
+            doc.page_rtl = rtl
+
 
 class TitlePage(PageTemplate):
 
     def __init__(self, cover=None, id=None,
-        onPage=_doNothing, onPageEnd=_doNothing, pagesize=(page_width, page_height)):
+        onPage=_doNothing, onPageEnd=_doNothing, pagesize=(page_width, page_height), cover_size=None):
 
         id = 'TitlePage'
         p = pdfstyles
@@ -124,10 +176,10 @@ class TitlePage(PageTemplate):
 
         PageTemplate.__init__(self,id=id, frames=frames,onPage=onPage,onPageEnd=onPageEnd,pagesize=pagesize)
         self.cover = cover
+        self.cover_size = cover_size # pixel size of the cover, if known already
 
     def _scale_img(self, img_area_size, img_fn):
-        img = Image.open(self.cover)
-        img_width, img_height = img.size
+        img_width, img_height = self.cover_size or Image.open(self.cover).size
         img_area_width = min(page_width,img_area_size[0])
         img_area_height = min(page_height, img_area_size[1])
         img_ar = img_width/img_height
@@ -185,6 +237,19 @@ class PPDocTemplate(BaseDocTemplate):
         self.tocCallback=tocCallback
         self.title = kwargs['title']
 
+    def handle_nextPageTitle(self, title, rtl=False):
+        if not hasattr(self, 'page_title'):
+            # nothing has a title yet: use it for the current page as well
+            self.page_title = title
+            self.page_rtl = rtl
+        self._nextPageTitle = (title, rtl)
+
+    def handle_pageBegin(self):
+        if hasattr(self, '_nextPageTitle'):
+            self.page_title, self.page_rtl = self._nextPageTitle
+            del self._nextPageTitle
+        BaseDocTemplate.handle_pageBegin(self)
+
     def progressCB(self, typ, value):
         if typ == 'SIZE_EST':
             self.estimatedDuration = int(value)
@@ -208,7 +273,10 @@ class PPDocTemplate(BaseDocTemplate):
                     }
         got_chapter = False
         last_lvl =  0
-        for (bm_id, (bm_title, bm_type)) in enumerate(self.bookmarks):
+        for (bm_id, bookmark) in enumerate(self.bookmarks):
+            # (title, type) or (title, type, anchor name) - see RlWriter.addBookmark
+            bm_title, bm_type = bookmark[:2]
+            bm_key = bookmark[2] if len(bookmark) > 2 else str(bm_id)
             lvl = type2lvl[bm_type]
             if bm_type== 'chapter':
                 got_chapter = True
@@ -216,7 +284,7 @@ class PPDocTemplate(BaseDocTemplate):
                 lvl -= 1
             lvl = min(lvl, last_lvl + 1)
             last_lvl = lvl
-            self.canv.addOutlineEntry(bm_title, str(bm_id), lvl, bm_type == 'article')
+            self.canv.addOutlineEntry(bm_title, bm_key, lvl, bm_type == 'article')
 
     def afterFlowable(self, flowable):
         """Our rule for the table of contents is simply to take
@@ -82,6 +82,8 @@ pagefooter = u''
 
 title_page_image = '' # path of an image that is to be displayed on the title page
 title_page_image_size = (12*cm, 17*cm) # max. width, height of image, aspect ratio is kept
+# larger images are downscaled to this resolution before they are embedded. 0: embed the original image
+title_page_image_dpi = 300
 # position of image relativ to bottom, left corner.
 # If component is set to None the image is centered
 # It is ensured that the image is not moved out of the page boundaries
@@ -100,6 +102,9 @@ creation_date_txt = 'PDF generated at: %s'
 # note that no TOC is generated if only one article is rendered
 render_toc = True
 
+# number of rendered article titles kept in memory, shared by all jobs of a process
+title_cache_size = 2000
+
 ### TABLE CONFIG
 
 tableOverflowTolerance = 20  # max width overflow for tables    unit: pt 
@@ -116,6 +121,21 @@ table_align = TA_CENTER
 
 treecleaner_skip_methods = ['fixPreFormatted', 'removeEmptyReferenceLists']
 
+######### EXTERNAL TOOLS
+
+# limits for the external tools used by the writer:
+# tool -> (max. number of concurrent processes, wall clock timeout in s, cpu time limit in s)
+tool_limits = {
+    'convert': (2, 60, 30),
+    'texvc': (4, 20, 10),
+    'pdfsam-console': (1, 300, 120),
+    'pdftk': (1, 300, 120),
+    }
+tool_default_limits = (2, 60, 30) # used for all other tools
+# the process limits are shared by all render processes using the same
+# directory. None: a private directory of the user in the temp dir
+tool_slot_dir = None
+
 ######### IMAGE CONFIGURATION
 
 # margins for floated images - margins like in html/css: (top, right, bottom, left)
@@ -132,6 +152,12 @@ print_width_px = 540 # 540px are assumed to be the equivalent for a full print w
 
 img_border_color=(0.75, 0.75, 0.75)
 
+img_jpeg_quality = 85 # quality of JPEGs written when images are downscaled
+# if set, embedded images are downscaled to this resolution at the size they are printed
+# and photographic PNGs are recompressed as JPEG. 0: embed images as they are
+img_target_dpi = 0
+img_svg_vector = True # embed SVGs as vector graphics if svglib is installed, otherwise they are rasterized
+
 link_images = True
 
 ######### TEXT CONFIGURATION
@@ -17,6 +17,7 @@ from reportlab.lib import colors
 from customflowables import Figure
 #import debughelper
 from mwlib.rl import pdfstyles
+from mwlib.rl.nodecontext import getContext
 from mwlib import advtree
 
 log = log.Log('rlwriter')
@@ -27,7 +28,7 @@ def scaleImages(data):
         for cell in row:
             for (i,e) in enumerate(cell):
                 if isinstance(e,Figure): # scale image to half size
-                    cell[i] = Figure(imgFile = e.imgPath, captionTxt=e.captionTxt, captionStyle=e.cs, imgWidth=e.imgWidth/2.0,imgHeight=e.imgHeight/2.0, margin=e.margin, padding=e.padding,align=e.align)
+                    cell[i] = Figure(imgFile = e.imgPath, captionTxt=e.captionTxt, captionStyle=e.cs, imgWidth=e.imgWidth/2.0,imgHeight=e.imgHeight/2.0, margin=e.margin, padding=e.padding,align=e.align, image_cache=e.image_cache, drawing=e.drawing)
 
             
 def getColWidths(data, table=None, recursionDepth=0, nestingLevel=1):
@@ -71,8 +72,9 @@ def getColWidths(data, table=None, recursionDepth=0, nestingLevel=1):
                     maxbreaks[j] = max(rows,maxbreaks[j])
             summedwidths[j] = max(cellwidth, summedwidths[j])
 
-    parent_cells = table.getParentNodesByClass(Cell)
-    parent_tables = table.getParentNodesByClass(Table)
+    context = getContext(table)
+    parent_cells = context.cells
+    parent_tables = context.tables
     # nested tables in colspanned cell are expanded to full page width
     if nestingLevel == 2 and parent_cells and parent_tables and parent_cells[0].colspan == parent_tables[0].numcols:
         availWidth -= 8
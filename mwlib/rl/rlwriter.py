@@ -14,9 +14,10 @@ import urllib
 import traceback
 import tempfile
 import shutil
-import subprocess
 import copy
 import gc
+import math
+import cPickle as pickle
 
 try:
     from hashlib import md5
@@ -26,6 +27,7 @@ except ImportError:
 from xml.sax.saxutils import escape as xmlescape
 from PIL import Image as PilImage
 
+import pygments
 from pygments import highlight
 from pygments  import lexers
 from rlsourceformatter import ReportlabFormatter
@@ -36,6 +38,13 @@ except ImportError:
     linuxmem = None
 
 
+def _configFingerprint():
+    """repr of the configuration that affects the layout, for cache keys"""
+    values = sorted((name, value) for name, value in vars(pdfstyles).items()
+                    if not name.startswith('_') and isinstance(value, (bool, int, long, float, basestring, tuple, list, dict)))
+    return repr((values, fontconfig.fonts))
+
+
 def _check_reportlab():
     from reportlab.pdfbase.pdfdoc import PDFDictionary
     try:
@@ -49,6 +58,7 @@ _check_reportlab()
 #import reportlab
 #reportlab.rl_config.platypus_link_underline = 1
 
+import reportlab
 from reportlab import rl_config
 
 from reportlab.platypus.paragraph import Paragraph
@@ -56,15 +66,14 @@ from reportlab.platypus.doctemplate import BaseDocTemplate
 
 from pagetemplates import PPDocTemplate
 
-from reportlab.platypus.doctemplate import NextPageTemplate, NotAtTopPageBreak
+from reportlab.platypus.doctemplate import NotAtTopPageBreak
 from reportlab.platypus.tables import Table
 from reportlab.platypus.flowables import Spacer, HRFlowable, PageBreak, CondPageBreak
-from reportlab.platypus.xpreformatted import XPreformatted
 from reportlab.lib.units import cm
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY, TA_RIGHT, TA_LEFT
 
-from mwlib.rl.customflowables import Figure, FiguresAndParagraphs, SmartKeepTogether, TocEntry, DummyTable
+from mwlib.rl.customflowables import Figure, FiguresAndParagraphs, SmartKeepTogether, TocEntry, DummyTable, LinePreformatted
 
 from pdfstyles import text_style, heading_style, table_style
 
@@ -75,13 +84,24 @@ from mwlib.writer.imageutils import ImageUtils
 from mwlib.writer import miscutils, styleutils
 
 import rltables
-from pagetemplates import WikiPage, TitlePage
+from pagetemplates import WikiPage, TitlePage, NextPageTitle
 
 from mwlib import parser, log, uparser,  timeline
 from mwlib.writer.licensechecker import LicenseChecker
+from mwlib.rl.licenseindex import getLicenseIndex
 from mwlib.rl import fontconfig
 from mwlib.rl.customnodetransformer import CustomNodeTransformer
 from mwlib.rl.formatter import RLFormatter
+from mwlib.rl.diskcache import DiskCache
+from mwlib.rl.imagecache import ImageCache, ImageRegistry, ImageInfoIndex
+from mwlib.rl.imagemeta import ImageMetaIndex
+from mwlib.rl.svgrenderer import SvgRenderer
+from mwlib.rl.executor import executor
+from mwlib.rl.jobreport import JobReport
+from mwlib.rl.nodecontext import getContext
+from mwlib.rl.computedstyle import getComputedStyle, getTextAlign
+from mwlib.rl.lrucache import LRUCache
+from mwlib.rl.nodetimer import NodeTimer
 
 log = log.Log('rlwriter')
 
@@ -93,7 +113,7 @@ try:
 except ImportError:
     pass
 
-from mwlib import advtree, writerbase
+from mwlib import advtree, writerbase, mathutils
 from mwlib.treecleaner import TreeCleaner
 
 
@@ -134,6 +154,62 @@ def buildPara(txtList, style=text_style(), txt_style=None):
         return []
 
 
+# custom mapping between mw-markup source attrs to pygments lexers if get_lexer_by_name fails
+_custom_lexers = {'lisp': lexers.CommonLispLexer}
+_lexer_cache = {}
+
+def getLexer(name):
+    """return a (shared) pygments lexer instance for a source language or None"""
+    if name in _lexer_cache:
+        return _lexer_cache[name]
+    try:
+        lexer = lexers.get_lexer_by_name(name)
+    except lexers.ClassNotFound:
+        lexer_class = _custom_lexers.get(name)
+        if lexer_class:
+            lexer = lexer_class()
+        else:
+            log.error('unknown source code language: %s' % repr(name))
+            lexer = None
+    _lexer_cache[name] = lexer
+    return lexer
+
+_source_formatter_cache = {}
+
+def getSourceFormatter(font_size):
+    """return a (shared) ReportlabFormatter for the given font size"""
+    formatter = _source_formatter_cache.get(font_size)
+    if formatter is None:
+        formatter = ReportlabFormatter(font_size=font_size, font_name='FreeMono', background_color='#eeeeee', line_numbers=False)
+        formatter.encoding = 'utf-8'
+        _source_formatter_cache[font_size] = formatter
+    return formatter
+
+# rendered article titles, shared by all writers of a process. see RlWriter.renderArticleTitle
+_title_cache = LRUCache(pdfstyles.title_cache_size)
+# pickled license flowables, shared by all writers of a process. see RlWriter.renderLicense.
+# only pickles made by this process are loaded, so they are kept in memory only
+_license_cache = LRUCache(20)
+# license bodies containing these nodes depend on or change the state of the book
+# (image files of the job, URL reference numbers) and are not cached
+_uncacheable_license_nodes = (advtree.ImageLink, advtree.Math, advtree.NamedURL)
+# titles without these characters contain no wiki markup and are rendered as plain text
+_title_markup = re.compile(u"['\\[\\]{}<>&|~:=_\n\r]|^[-*#;:!\\s]")
+# nodes kept in article titles by RlWriter.cleanTitle. rendering them has no side effects
+_title_node_classes = (advtree.Emphasized, advtree.Strong, advtree.Text, advtree.Sup,
+                       advtree.Sub, advtree.Node, advtree.Strike)
+
+
+class ArticleMeta(object):
+    """metadata of a book article, see RlWriter.getArticleMeta"""
+
+    def __init__(self, ns, url, source, authors):
+        self.ns = ns
+        self.url = url # canonical URL or None
+        self.source = source # as returned by wiki.getSource
+        self.authors = authors
+
+
 class ReportlabError(Exception):
 
     def __init__(self, value):
@@ -145,7 +221,7 @@ class ReportlabError(Exception):
 
 class RlWriter(object):
 
-    def __init__(self, env=None, strict=False, debug=False, mathcache=None, lang=None, test_mode=False):
+    def __init__(self, env=None, strict=False, debug=False, mathcache=None, lang=None, test_mode=False, cachedir=None, report=None, nodetimes=None):
         localedir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'locale')
         translation = gettext.NullTranslations()
         if lang:
@@ -195,7 +271,8 @@ class RlWriter(object):
             self.license_checker = LicenseChecker(image_db=self.imgDB, filter_type='whitelist')
         else:
             self.license_checker = LicenseChecker(image_db=self.imgDB, filter_type='blacklist')
-        self.license_checker.readLicensesCSV()
+        # displayImage and getLicenseDisplayName memoize their results per image for the whole job
+        self.license_checker.licenses = getLicenseIndex()
 
         self.img_meta_info = {}
         self.img_count = 0
@@ -211,6 +288,13 @@ class RlWriter(object):
 
         self.cnt = CustomNodeTransformer()
         self.formatter = RLFormatter(font_switcher=self.font_switcher)
+        self._write_methods = {} # node class -> write method, see write()
+        # nodes of these classes always change the formatting state. tables
+        # can scale the font size in getTableSize and rely on write() to reset it
+        self._styled_classes = set(self.formatter.node_styles) | set([advtree.Table])
+        # descendants of these classes are counted by prepareWrite
+        self._class_index = dict((klass, idx) for idx, klass in enumerate([
+            advtree.Math, advtree.NamedURL, advtree.Reference, advtree.Sup, advtree.PreFormatted, advtree.ImageLink]))
 
         self.image_utils = ImageUtils(pdfstyles.print_width,
                                       pdfstyles.print_height,
@@ -245,11 +329,38 @@ class RlWriter(object):
         self.sourceCount = 0
         self.currentColCount = 0
         self.math_cache_dir = mathcache or os.environ.get('MWLIBRL_MATHCACHE')
+        self.cache_dir = cachedir or os.environ.get('MWLIBRL_CACHEDIR')
+        if self.cache_dir:
+            self.source_cache = DiskCache(self.cache_dir, 'source')
+        else:
+            self.source_cache = None
+        self.lang = lang
         self.tmpdir = tempfile.mkdtemp()
+        self.image_cache = ImageCache(self.cache_dir or self.tmpdir, jpeg_quality=pdfstyles.img_jpeg_quality)
+        self.image_registry = ImageRegistry()
+        self.image_info = ImageInfoIndex()
+        self.svg_renderer = SvgRenderer()
+        self.report = JobReport(timed=bool(report)) # the counters are also used by renderLicense
+        self.report_path = report
+        self.nodetimes_path = nodetimes
+        if nodetimes:
+            self.node_timer = NodeTimer()
+            self._untimedWrite = self.write
+            self.write = self._timedWrite # no overhead unless enabled
+        else:
+            self.node_timer = None
+        if not (pdfstyles.img_svg_vector and self.svg_renderer.available()):
+            self.svg_renderer = None
         self.bookmarks = []
+        self.bookmark_prefix = None # see addBookmark
+        self.prefixed_bookmarks = []
         self.colwidth = 0
 
         self.articleids = []
+        self._articleid_set = set() # same as articleids, for lookups
+        self._article_meta = {} # (wiki, title, revision) -> ArticleMeta
+        self._image_meta = {} # id(image db) -> ImageMetaIndex
+        self._article_id_cache = {} # (wikiurl, article name) -> article id
         self.layout_status = None
         self.toc_entries = []
         self.toc_renderer = TocRenderer()
@@ -302,20 +413,6 @@ class RlWriter(object):
 
         return groupedElements
 
-    def check_direction(self, node):
-        original = self.rtl
-        try:
-            direction = node.vlist.get('dir', '') or node.vlist.get('style', {}).get('direction', '')
-        except (AttributeError):
-            pass
-        else:
-            direction = direction.lower().strip()
-            if direction == 'ltr':
-                self.set_rtl(False)
-            elif direction == 'rtl':
-                self.set_rtl(True)
-        return original
-
     def set_rtl(self, rtl):
         self.rtl = rtl
         if rtl == True:
@@ -323,47 +420,140 @@ class RlWriter(object):
         else:
             pdfstyles.word_wrap = self.word_wrap
 
-    def handle_page_break(self, node, mode='before'):
-        # mode:
-        # before for page-break-before
-        # after for page-break-after
-        css_style = None
-        if node.vlist:
-            css_style = node.vlist.get('style', None)
-            if css_style:
-                page_break = css_style.get('page-break-%s' % mode, None)
-        if css_style and page_break:
-            if page_break in ['always', '100%']:
-                return NotAtTopPageBreak()
-            res = re.search('(\d{1,2})\%', page_break)
-            if res:
-                min_percent = int(res.groups()[0])
-                return CondPageBreak(min_percent/100.0*pdfstyles.print_height)
+    def _parsePageBreak(self, page_break):
+        # css page-break-before/after -> 'always', fraction of the print height or None
+        if not page_break:
+            return None
+        if page_break in ['always', '100%']:
+            return 'always'
+        res = re.search('(\d{1,2})\%', page_break)
+        if res:
+            return int(res.groups()[0])/100.0
         return None
 
+    def _makePageBreak(self, page_break):
+        if page_break == 'always':
+            return NotAtTopPageBreak()
+        return CondPageBreak(page_break*pdfstyles.print_height)
+
+    def _getWriteInfo(self, node):
+        """Return what write() has to do for node besides calling the write
+        method: None for the (many) nodes without own styles, direction or
+        page breaks, (direction, page break before, page break after, compiled
+        css) otherwise. The result is stored in the node, see prepareWrite."""
+        vlist = getattr(node, 'vlist', None) or {}
+        css = vlist.get('style') or {}
+        if not isinstance(css, dict):
+            css = {}
+        direction = (vlist.get('dir', '') or css.get('direction', '')).lower().strip()
+        direction = {'ltr': False, 'rtl': True}.get(direction)
+        pb_before = self._parsePageBreak(css.get('page-break-before'))
+        pb_after = self._parsePageBreak(css.get('page-break-after'))
+        if css or direction is not None or node.__class__ in self._styled_classes:
+            info = (direction, pb_before, pb_after, self.formatter.compileCssStyle(node))
+        else:
+            info = None
+        node._write_info = info
+        return info
+
+    def prepareWrite(self, root):
+        """Prepare a cleaned tree for writing in one depth first pass: apply
+        the css_map (see CustomNodeTransformer) and precompute the write
+        info (see _getWriteInfo), the ancestor context (see
+        nodecontext.getContext), the computed style (see
+        computedstyle.getComputedStyle) and the descendant counts (see
+        countDescendants) of all nodes."""
+        class_index = self._class_index
+        no_descendants = (0,) * len(class_index)
+        transformNodeCSS = self.cnt.transformNodeCSS
+        transformNodeCSS(root)
+        root._context = getContext(root)
+        root._computed_style = getComputedStyle(root)
+        stack = [(root, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if node.children and not children_done:
+                context = node._context.enter(node)
+                computed = node._computed_style
+                for child in node.children:
+                    transformNodeCSS(child) # before anything looks at the style of child
+                    child._context = context
+                    child._computed_style = computed.derive(child)
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children)
+                continue
+            self._getWriteInfo(node)
+            counts = None
+            max_math_len = 0
+            for child in node.children:
+                if child._descendants is not no_descendants:
+                    counts = counts or [0] * len(no_descendants)
+                    for idx, count in enumerate(child._descendants):
+                        counts[idx] += count
+                idx = class_index.get(child.__class__)
+                if idx is not None:
+                    counts = counts or [0] * len(no_descendants)
+                    counts[idx] += 1
+                    if child.__class__ == advtree.Math:
+                        max_math_len = max(max_math_len, len(child.caption))
+                max_math_len = max(max_math_len, child._max_math_len)
+            node._descendants = tuple(counts) if counts else no_descendants
+            node._max_math_len = max_math_len
+
+    def countDescendants(self, node, klass):
+        """same as len(node.getChildNodesByClass(klass)), but answered from the
+        index built by prepareWrite for the classes in _class_index"""
+        try:
+            return node._descendants[self._class_index[klass]]
+        except AttributeError: # node was not part of a prepared tree
+            return len(node.getChildNodesByClass(klass))
+
+    def maxMathLength(self, node):
+        """length of the longest formula below node"""
+        try:
+            return node._max_math_len
+        except AttributeError:
+            return max([len(math.caption) for math in node.getChildNodesByClass(advtree.Math)] or [0])
+
+    def _timedWrite(self, obj):
+        self.node_timer.enter(obj.__class__.__name__)
+        try:
+            return self._untimedWrite(obj)
+        finally:
+            self.node_timer.leave()
+
     def write(self, obj):
-        m = "write" + obj.__class__.__name__
-        if not hasattr(self, m):
-            log.error('unknown node:', repr(obj.__class__.__name__))
+        cls = obj.__class__
+        m = self._write_methods.get(cls)
+        if m is None:
+            m = self._write_methods[cls] = getattr(self, 'write' + cls.__name__, False)
+        if not m:
+            log.error('unknown node:', repr(cls.__name__))
             if self.strict:
-                raise writerbase.WriterError('Unkown Node: %s ' % obj.__class__.__name__)
+                raise writerbase.WriterError('Unkown Node: %s ' % cls.__name__)
             return []
-        m=getattr(self, m)
-        styles = self.formatter.setStyle(obj)
-        original = self.check_direction(obj)
+        try:
+            info = obj._write_info
+        except AttributeError: # node was not part of a prepared tree
+            info = self._getWriteInfo(obj)
+        if info is None:
+            return m(obj)
+        direction, pb_before, pb_after, css_ops = info
+        styles = self.formatter.setCompiledStyle(obj, css_ops)
+        original = self.rtl
+        if direction is not None:
+            self.set_rtl(direction)
         res = m(obj)
         self.set_rtl(original)
         self.formatter.resetStyle(styles)
-        pb_before = self.handle_page_break(obj, 'before')
-        pb_after = self.handle_page_break(obj, 'after')
         if pb_before:
             if not isinstance(res, list):
                 res = [res]
-            res.insert(0, pb_before)
+            res.insert(0, self._makePageBreak(pb_before))
         if pb_after:
             if not isinstance(res, list):
                 res = [res]
-            res.append(pb_after)
+            res.append(self._makePageBreak(pb_after))
         return res
 
     def getVersion(self):
@@ -382,32 +572,33 @@ class RlWriter(object):
         return version
 
     def buildArticle(self, item):
+        phase = self.report.startPhase('parse')
         mywiki = item.wiki
         art = mywiki.getParsedArticle(title=item.title,
                                              revision=item.revision)
         if not art:
+            self.report.endPhase(phase)
             return # FIXME
-        try:
-            ns = item.wiki.normalize_and_get_page(item.title,0).ns
-        except AttributeError:
-            ns = 0
-        art.ns = ns
-        art.url = mywiki.getURL(item.title, item.revision) or None
+        meta = self.getArticleMeta(item)
+        art.ns = meta.ns
+        art.url = meta.url
         if item.displaytitle is not None:
             art.caption = item.displaytitle
-        source = mywiki.getSource(item.title, item.revision)
-        if source:
-            art.wikiurl = source.url or ""
+        if meta.source:
+            art.wikiurl = meta.source.url or ""
         else:
             art.wikiurl = None
-        art.authors = mywiki.getAuthors(item.title, revision=item.revision)
+        art.authors = meta.authors
         advtree.buildAdvancedTree(art)
+        self.report.endPhase(phase)
         if self.debug:
             parser.show(sys.stdout, art)
             pass
+        phase = self.report.startPhase('treeclean')
         self.tc.tree = art
         self.tc.cleanAll()
-        self.cnt.transformCSS(art)
+        self.prepareWrite(art)
+        self.report.endPhase(phase)
         if self.debug:
             #parser.show(sys.stdout, art)
             print "\n".join([repr(r) for r in self.tc.getReports()])
@@ -440,9 +631,18 @@ class RlWriter(object):
                                   bottomMargin=pdfstyles.page_margin_bottom,
                                   title='',
                                   )
-        # PageTemplates are registered to self.doc in writeArticle
+        testdoc.addPageTemplates(WikiPage(rtl=self.rtl))
         doc_bak, self.doc = self.doc, testdoc
-        elements = self.writeArticle(node)
+        # the article is written again for the book, only count and time that pass
+        self.report.suspended = True
+        timer_bak = self.node_timer
+        if timer_bak:
+            self.node_timer = NodeTimer()
+        try:
+            elements = self.writeArticle(node)
+        finally:
+            self.report.suspended = False
+            self.node_timer = timer_bak
         try:
             testdoc.build(elements)
             self.doc = doc_bak
@@ -455,14 +655,16 @@ class RlWriter(object):
             return False
 
     def addDummyPage(self):
-        pt = WikiPage('')
-        self.doc.addPageTemplates(pt)
         return Paragraph(' ', text_style())
 
 
     def writeBook(self, output, coverimage=None, status_callback=None):
         self.numarticles = len(self.env.metabook.articles())
         self.articlecount = 0
+        self.report.newAttempt()
+        phase = self.report.startPhase('metadata')
+        self.prefetchArticleMeta()
+        self.report.endPhase(phase)
         self.getArticleIDs()
 
         if status_callback:
@@ -478,6 +680,8 @@ class RlWriter(object):
         self.toc_entries = []
         if pdfstyles.show_title_page:
             elements.extend(self.writeTitlePage(coverimage=coverimage or pdfstyles.title_page_image))
+        # all article, license and attribution pages share one template, see NextPageTitle
+        self.doc.addPageTemplates(WikiPage(rtl=self.rtl))
 
         if self.numarticles == 0:
             elements.append(self.addDummyPage())
@@ -495,25 +699,35 @@ class RlWriter(object):
                 elements.extend(self.writeChapter(chapter))
                 got_chapter = True
             elif item.type == 'article':
+                self.report.startArticle(item.title)
                 art = self.buildArticle(item)
                 self.imgDB = item.images
                 self.license_checker.image_db = self.imgDB
                 if not art:
+                    self.report.article['skipped'] = True
+                    self.report.endArticle()
                     continue
                 if got_chapter:
                     art.has_preceeding_chapter = True
                     got_chapter = False
                 if self.fail_safe_rendering:
+                    phase = self.report.startPhase('check')
                     if not self.articleRenderingOK(copy.deepcopy(art), output):
                         art.renderFailed = True
+                    self.report.endPhase(phase)
+                phase = self.report.startPhase('layout')
                 art_elements = self.writeArticle(art)
                 del art
                 elements.extend(self.groupElements(art_elements))
+                self.report.endPhase(phase)
+                self.report.endArticle()
 
         try:
             self.renderBook(elements, output, coverimage=coverimage)
             log.info('RENDERING OK')
             shutil.rmtree(self.tmpdir, ignore_errors=True)
+            self.report.setPages(self.doc.page, self.toc_entries)
+            self.writeReport()
             return
         except MemoryError:
             shutil.rmtree(self.tmpdir, ignore_errors=True)
@@ -524,12 +738,22 @@ class RlWriter(object):
             if self.fail_safe_rendering:
                 log.error('GIVING UP')
                 shutil.rmtree(self.tmpdir, ignore_errors=True)
+                self.writeReport()
                 raise RuntimeError('Giving up.')
             else:
                 self.fail_safe_rendering = True
                 self.writeBook(output, coverimage=coverimage, status_callback=status_callback)
 
 
+    def writeReport(self):
+        if self.node_timer:
+            self.node_timer.write(self.nodetimes_path)
+        if not self.report_path:
+            return
+        self.report.write(self.report_path)
+        if self.render_status:
+            self.render_status(report=self.report.asDict())
+
     def renderBook(self, elements, output, coverimage=None):
         if pdfstyles.show_article_attribution:
             elements.append(TocEntry(txt=_('References'), lvl='group'))
@@ -557,13 +781,20 @@ class RlWriter(object):
             gc.collect()
             if linuxmem:
                 log.info('memory usage after laying out:', linuxmem.memory())
+            phase = self.report.startPhase('build')
             self.doc.build(elements)
+            self.report.endPhase(phase)
             if pdfstyles.render_toc and self.numarticles > 1:
+                phase = self.report.startPhase('toc')
                 err = self.toc_renderer.build(output, self.toc_entries, has_title_page=bool(self.book.title), rtl=self.rtl)
+                self.report.endPhase(phase)
                 if err:
                     log.warning('TOC not rendered. Probably pdftk is not properly installed. returncode: %r' % err)
             if linuxmem:
                 log.info('memory usage after reportlab rendering:', linuxmem.memory())
+            log.info(self.image_registry.getStats())
+            if executor.stats:
+                log.info('external tools:\n' + executor.getStats())
         except:
             traceback.print_exc()
             log.info('rendering failed - trying safe rendering')
@@ -583,15 +814,118 @@ class RlWriter(object):
         if self.env.getLicenses():
             elements.append(TocEntry(txt=_('Article Licenses'), lvl='group'))
 
+        config = _configFingerprint()
+        # internal links in licenses only become links if the target is in the book
+        book = DiskCache.makeKey(*sorted(self._articleid_set))
         for license in self.env.getLicenses():
-            license_node = uparser.parseString(title=_(license.title), raw=license.wikitext, wikidb=license._wiki)
+            title = _(license.title)
+            key = self._getLicenseKey(license, title, config, book)
+            data = _license_cache.get(key)
+            cached = None
+            if data is not None:
+                try:
+                    cached = pickle.loads(data)
+                except Exception, exc:
+                    log.warning('could not load cached license %r: %s' % (title, exc))
+            if cached is not None:
+                license_node = advtree.Article()
+                license_node.caption = title
+                elements.extend(self.writeArticle(license_node, writeBody=self._getCachedBodyWriter(*cached)))
+                continue
+            license_node = uparser.parseString(title=title, raw=license.wikitext, wikidb=license._wiki)
             advtree.buildAdvancedTree(license_node)
             self.tc.tree = license_node
             self.tc.cleanAll()
-            elements.extend(self.writeArticle(license_node))
+            if any(license_node.getChildNodesByClass(klass) for klass in _uncacheable_license_nodes):
+                elements.extend(self.writeArticle(license_node))
+            else:
+                elements.extend(self.writeArticle(license_node, writeBody=self._getCachingBodyWriter(key)))
         self.license_mode = False
         return elements
 
+    def _getLicenseKey(self, license, title, config, book):
+        """Key of the flowables of a license body. Besides the license and the
+        configuration, the body depends on the wiki which expands its
+        templates and on the articles of the book (book), the targets of its
+        internal links."""
+        try:
+            wiki = license._wiki.siteinfo['general']['server']
+        except (AttributeError, KeyError, TypeError):
+            wiki = None
+        return DiskCache.makeKey(license.wikitext, title, self.lang, self.rtl, wiki, book,
+                                 config, rlwriterversion, reportlab.Version)
+
+    def _getBookState(self):
+        """what rendering a license body must not change to be cacheable"""
+        counters = self.report.counters
+        return (counters['images'], counters['formulas'], len(self.url_map), len(self.img_meta_info))
+
+    def _getCachedBodyWriter(self, body, bookmarks):
+        def writeBody(article):
+            self.bookmarks.extend(bookmarks)
+            return body
+        return writeBody
+
+    def _getCachingBodyWriter(self, key):
+        """writeArticleBody for a license. The flowables are stored in the
+        license cache. Their bookmark anchors get names derived from key
+        instead of the number of bookmarks before them, so that they fit
+        into any book. Bodies that left traces in the book (images,
+        formulas, URL references) are not stored."""
+        def writeBody(article):
+            self.bookmark_prefix = 'license-%s-' % key
+            self.prefixed_bookmarks = []
+            state = self._getBookState()
+            try:
+                body = self.writeArticleBody(article)
+            finally:
+                self.bookmark_prefix = None
+            if self._getBookState() != state:
+                return body
+            try:
+                data = pickle.dumps((body, self.prefixed_bookmarks), 2)
+            except Exception, exc: # some flowables can not be pickled
+                log.warning('could not cache license %r: %s' % (article.caption, exc))
+                return body
+            _license_cache.set(key, data)
+            return body
+        return writeBody
+
+
+    def getArticleMeta(self, item):
+        """Return the ArticleMeta of an article item. The wiki is only asked
+        once per article, see prefetchArticleMeta."""
+        key = (id(item.wiki), item.title, item.revision)
+        meta = self._article_meta.get(key)
+        if meta is None:
+            wiki = item.wiki
+            try:
+                ns = wiki.normalize_and_get_page(item.title, 0).ns
+            except AttributeError:
+                ns = 0
+            meta = self._article_meta[key] = ArticleMeta(
+                ns=ns,
+                url=wiki.getURL(item.title, item.revision) or None,
+                source=wiki.getSource(item.title, item.revision),
+                authors=wiki.getAuthors(item.title, revision=item.revision))
+        return meta
+
+    def prefetchArticleMeta(self):
+        """Fetch the metadata of all articles of the book in one pass
+        before the layout, which then reads it from memory."""
+        for item in self.env.metabook.walk():
+            if item.type == 'article':
+                self.getArticleMeta(item)
+                if item.images is not None:
+                    self.getImageMeta(item.images)
+
+    def getImageMeta(self, image_db=None):
+        """the ImageMetaIndex of image_db (default: the current image DB)"""
+        image_db = image_db or self.imgDB
+        index = self._image_meta.get(id(image_db))
+        if index is None: # the index keeps image_db alive, so its id is not reused
+            index = self._image_meta[id(image_db)] = ImageMetaIndex(image_db)
+        return index
 
     def getArticleIDs(self):
         self.articleids=[]
@@ -600,13 +934,14 @@ class RlWriter(object):
                 continue
             title = item.displaytitle or item.title
 
-            source = item.wiki.getSource(item.title, item.revision)
+            source = self.getArticleMeta(item).source
             if source:
                 wikiurl = source.url
             else:
                 wikiurl = item.title
             article_id = self.buildArticleID(wikiurl, title)
             self.articleids.append(article_id)
+        self._articleid_set = set(self.articleids)
 
     def tocCallback(self, info):
         self.toc_entries.append(info)
@@ -626,31 +961,40 @@ class RlWriter(object):
             if item.type == 'article':
                 first_article_title = self.renderArticleTitle(item.displaytitle or item.title)
                 break
-        self.doc.addPageTemplates(TitlePage(cover=coverimage))
+        if coverimage and pdfstyles.title_page_image_dpi:
+            max_width, max_height = pdfstyles.title_page_image_size
+            coverimage = self.image_cache.fitImage(coverimage,
+                                                   min(pdfstyles.page_width, max_width),
+                                                   min(pdfstyles.page_height, max_height),
+                                                   pdfstyles.title_page_image_dpi)
+        cover_size = None
+        if coverimage:
+            try:
+                cover_size = self.image_info.getSize(coverimage)
+            except (IOError, OSError):
+                log.warning('cover image can not be opened by PIL: %r' % coverimage)
+                coverimage = None
+        self.doc.addPageTemplates(TitlePage(cover=coverimage, cover_size=cover_size))
         elements = []
         elements.append(Paragraph(self.formatter.cleanText(title), text_style(mode='booktitle')))
         if subtitle:
             elements.append(Paragraph(self.formatter.cleanText(subtitle), text_style(mode='booksubtitle')))
         if not first_article_title:
             return elements
-        self.doc.addPageTemplates(WikiPage(first_article_title, rtl=self.rtl))
-        elements.append(NextPageTemplate(first_article_title.encode('utf-8')))
+        elements.append(NextPageTitle(first_article_title, rtl=self.rtl))
         elements.append(PageBreak())
         return elements
 
     def _getPageTemplate(self, title):
         template_title =self.renderArticleTitle(title)
-        page_template = WikiPage(template_title, rtl=self.rtl)
-        self.doc.addPageTemplates(page_template)
-        return NextPageTemplate(template_title.encode('utf-8'))
+        return NextPageTitle(template_title, rtl=self.rtl)
 
     def writeChapter(self, chapter):
         hr = HRFlowable(width="80%", spaceBefore=6, spaceAfter=0, color=pdfstyles.chapter_rule_color, thickness=0.5)
 
         title = self.renderArticleTitle(chapter.caption)
         if self.inline_mode == 0 and self.table_nesting==0:
-            chapter_anchor = '<a name="%s" />' % len(self.bookmarks)
-            self.bookmarks.append((title, 'chapter'))
+            chapter_anchor = '<a name="%s" />' % self.addBookmark(title, 'chapter')
         else:
             chapter_anchor = ''
         chapter_para = Paragraph('%s%s' % (title, chapter_anchor), heading_style('chapter'))
@@ -681,9 +1025,8 @@ class RlWriter(object):
         self.formatter.sectiontitle_mode = False
 
         if 1 <= lvl <= 4 and self.inline_mode == 0 and self.table_nesting==0:
-            anchor = '<a name="%d"/>' % len(self.bookmarks)
             bm_type = 'article' if lvl==1 else 'heading%s' % lvl
-            self.bookmarks.append((obj.children[0].getAllDisplayText(), bm_type))
+            anchor = '<a name="%s"/>' % self.addBookmark(obj.children[0].getAllDisplayText(), bm_type)
         else:
             anchor = ''
         elements = [Paragraph('<font name="%s"><b>%s</b></font>%s' % (headingStyle.fontName, heading_txt, anchor), headingStyle)]
@@ -706,6 +1049,12 @@ class RlWriter(object):
         return elements
 
     def buildArticleID(self, wikiurl, article_name):
+        article_id = self._article_id_cache.get((wikiurl, article_name))
+        if article_id is None:
+            article_id = self._article_id_cache[(wikiurl, article_name)] = self._buildArticleID(wikiurl, article_name)
+        return article_id
+
+    def _buildArticleID(self, wikiurl, article_name):
         tmplink = advtree.Link()
         tmplink.target = article_name
         tmplink.capitalizeTarget = True # this is a hack, this info should pulled out of the environment if available
@@ -767,31 +1116,54 @@ class RlWriter(object):
         return elements
 
     def cleanTitle(self, node):
-        if node.__class__ not in [advtree.Emphasized,
-                                  advtree.Strong,
-                                  advtree.Text,
-                                  advtree.Sup,
-                                  advtree.Sub,
-                                  advtree.Node,
-                                  advtree.Strike,
-                                  ]:
+        if node.__class__ not in _title_node_classes:
             node.parent.removeChild(node)
         else:
             for c in node.children:
                 self.cleanTitle(c)
 
+    def _formatterState(self):
+        f = self.formatter
+        fs = self.font_switcher
+        return (tuple(f.getCurrentStyles()), f.pre_mode, f.source_mode, f.minimize_space_mode,
+                f.sectiontitle_mode, f.table_nesting, f.default_font, self.rtl, self.word_wrap,
+                fs.space_cjk, fs.force_font, fs.default_font)
+
     def renderArticleTitle(self, raw):
-        title_node = uparser.parseString(title='', raw=raw, expandTemplates=False)
-        advtree.buildAdvancedTree(title_node)
-        title_node.__class__ = advtree.Node
-        self.cleanTitle(title_node)
-        res = self.renderInline(title_node)
-        return ''.join(res)
-
-    def writeArticle(self, article):
+        if raw and not _title_markup.search(raw):
+            return self.renderText(raw)
+        key = (raw, self._formatterState())
+        title = _title_cache.get(key)
+        if title is None:
+            title_node = uparser.parseString(title='', raw=raw, expandTemplates=False)
+            advtree.buildAdvancedTree(title_node)
+            title_node.__class__ = advtree.Node
+            self.cleanTitle(title_node)
+            res = self.renderInline(title_node)
+            title = ''.join(res)
+            # cleanTitle can miss nodes (e.g. adjacent links) whose rendering
+            # has side effects like collecting links, these are not cached
+            if all(n.__class__ in _title_node_classes for n in title_node.allchildren()):
+                _title_cache.set(key, title)
+        return title
+
+    def addBookmark(self, title, bm_type):
+        """Add an entry to the PDF outline and return the name of its anchor.
+        The anchor is the number of the bookmark unless bookmark_prefix is set."""
+        if self.bookmark_prefix is None:
+            self.bookmarks.append((title, bm_type))
+            return str(len(self.bookmarks) - 1)
+        name = '%s%d' % (self.bookmark_prefix, len(self.prefixed_bookmarks))
+        self.prefixed_bookmarks.append((title, bm_type, name))
+        self.bookmarks.append((title, bm_type, name))
+        return name
+
+    def writeArticle(self, article, writeBody=None):
         if self.license_mode and self.debug:
             return []
         self.references = []
+        if self.node_timer:
+            self.node_timer.setArticle(article.caption)
         title = self.renderArticleTitle(article.caption)
 
         log.info('rendering: %r' % (article.url or article.caption))
@@ -815,8 +1187,7 @@ class RlWriter(object):
                     elements.append(CondPageBreak(pdfstyles.article_start_min_space))
 
         if self.inline_mode == 0 and self.table_nesting==0:
-            heading_anchor = '<a name="%d"/>' % len(self.bookmarks)
-            self.bookmarks.append((article.caption, 'article'))
+            heading_anchor = '<a name="%s"/>' % self.addBookmark(article.caption, 'article')
         else:
             heading_anchor = ''
 
@@ -837,11 +1208,27 @@ class RlWriter(object):
         else:
             elements.append(Spacer(0,10))
 
+        elements.extend((writeBody or self.writeArticleBody)(article))
+
+        if not self.license_mode and not self.fail_safe_rendering:
+            self.article_meta_info.append((title, url, getattr(article, 'authors', '')))
+
+        if self.layout_status:
+            if not self.numarticles:
+                self.layout_status(progress=100)
+            else:
+                self.layout_status(progress=100*self.articlecount/self.numarticles)
+
+        self.reference_list_rendered = False
+        return elements
+
+    def writeArticleBody(self, article):
+        """the flowables of an article below its heading"""
         if not hasattr(article, 'renderFailed'): # if rendering of the whole book failed, failed articles are flagged
-            elements.extend(self.renderMixed(article))
+            elements = self.renderMixed(article)
         else:
             articleFailText = _('<strong>WARNING: Article could not be rendered - ouputting plain text.</strong><br/>Potential causes of the problem are: (a) a bug in the pdf-writer software (b) problematic Mediawiki markup (c) table is too wide')
-            elements.extend(self.renderFailedNode(article, articleFailText))
+            elements = self.renderFailedNode(article, articleFailText)
 
         # check for non-flowables
         elements = [e for e in elements if not isinstance(e,basestring)]
@@ -852,21 +1239,10 @@ class RlWriter(object):
             ref_elements = [Paragraph(
                     '<b>' + _('References') + '</b>', heading_style('section', lvl=3))]
             ref_elements.extend(self.writeReferenceList())
-            if isinstance(elements[-1], CondPageBreak):
+            if elements and isinstance(elements[-1], CondPageBreak):
                 elements[-1:-1] = ref_elements
             else:
                 elements.extend(ref_elements)
-
-        if not self.license_mode and not self.fail_safe_rendering:
-            self.article_meta_info.append((title, url, getattr(article, 'authors', '')))
-
-        if self.layout_status:
-            if not self.numarticles:
-                self.layout_status(progress=100)
-            else:
-                self.layout_status(progress=100*self.articlecount/self.numarticles)
-
-        self.reference_list_rendered = False
         return elements
 
     def writeParagraph(self,obj):
@@ -992,7 +1368,7 @@ class RlWriter(object):
                 if w > img.imgWidth:
                     scaled = img
                 else:
-                    scaled = Figure(img.imgPath, img.captionTxt, img.cs, imgWidth=w, imgHeight=h, margin=img.margin, padding=img.padding, borderColor=img.borderColor, url=img.url)
+                    scaled = Figure(img.imgPath, img.captionTxt, img.cs, imgWidth=w, imgHeight=h, margin=img.margin, padding=img.padding, borderColor=img.borderColor, url=img.url, image_cache=img.image_cache, drawing=img.drawing)
                 scaled_images.append(scaled)
             return scaled_images
 
@@ -1038,20 +1414,33 @@ class RlWriter(object):
 
 
         avail_width = self.getAvailWidth()
-        width = None
         style = text_style(mode='preformatted', in_table=self.table_nesting)
-        while not width or width > avail_width:
-            pre = XPreformatted(t, style)
-            width, height = pre.wrap(avail_width, pdfstyles.page_height)
-            style.fontSize -= .5
-            if style.fontSize < pdfstyles.min_preformatted_size:
+        pre = LinePreformatted(t, style)
+        width, height = pre.wrap(avail_width, pdfstyles.page_height)
+        if width > avail_width:
+            font_size = self._fitFontSize(style.fontSize, width, avail_width,
+                                          style.leftIndent + style.rightIndent)
+            if font_size >= pdfstyles.min_preformatted_size:
+                style.fontSize = font_size
+                pre = LinePreformatted(t, style)
+                width, height = pre.wrap(avail_width, pdfstyles.page_height)
+            if width > avail_width: # explicit font sizes in the markup do not scale
                 style = text_style(mode='preformatted', in_table=self.table_nesting)
                 char_limit = max(1, int(pdfstyles.source_max_line_len / (max(1, 0.75*self.currentColCount))))
                 t = self.breakLongLines(t, char_limit)
-                pre = XPreformatted(t, style)
-                break
+                pre = LinePreformatted(t, style)
         return [pre]
 
+    def _fitFontSize(self, font_size, width, avail_width, indent=0):
+        """Return the font size (rounded down to half points) at which
+        preformatted content of the given width fits into avail_width.
+        The width of a preformatted block grows linearly with its font size,
+        except for the indent (left + right) which is included in width.
+        """
+        if avail_width <= indent or width <= indent:
+            return 0
+        return math.floor(2 * font_size * (avail_width - indent) / (width - indent)) / 2
+
     def writeNode(self,obj):
         return self.renderMixed(obj)
 
@@ -1073,7 +1462,7 @@ class RlWriter(object):
                 txt.append(self.renderText(child.getAllDisplayText()))
         self.inline_mode -= 1
 
-        text_color = styleutils.rgbColorFromNode(node)
+        text_color = getComputedStyle(node).color
         if text_color:
             hex_col = ''.join('%02x' % int(c*255) for c in text_color)
             txt.insert(0, '<font color="#%s">' % hex_col)
@@ -1090,11 +1479,8 @@ class RlWriter(object):
             para_style.fontSize = max(text_style('license').fontSize, para_style.fontSize - 4)
             para_style.leading = 1
 
-        math_nodes = node.getChildNodesByClass(advtree.Math)
-        if math_nodes:
-            max_source_len = max([len(math.caption) for math in math_nodes])
-            if max_source_len > pdfstyles.no_float_math_len:
-                para_style.flowable = False
+        if self.maxMathLength(node) > pdfstyles.no_float_math_len:
+            para_style.flowable = False
 
         txt = []
         if textPrefix:
@@ -1102,13 +1488,14 @@ class RlWriter(object):
         items = []
 
         if isinstance(node, advtree.Node): #set node styles like text/bg colors, alignment
-            text_color = styleutils.rgbColorFromNode(node)
-            background_color = styleutils.rgbBgColorFromNode(node)
+            computed = getComputedStyle(node)
+            text_color = computed.color
+            background_color = computed.background
             if text_color:
                 para_style.textColor = text_color
             if background_color:
                 para_style.backColor = background_color
-            align = styleutils.getTextAlign(node)
+            align = getTextAlign(node)
             if align in ['right', 'center', 'justify']:
                 align_map = {'right': TA_RIGHT,
                              'center': TA_CENTER,
@@ -1213,12 +1600,10 @@ class RlWriter(object):
         #looking for internal links
         internallink = False
         if isinstance(obj, advtree.ArticleLink) and obj.url:
-            a = obj.getParentNodesByClass(advtree.Article)
-            wikiurl = ''
-            if a:
-                wikiurl = getattr(a[0], 'wikiurl', '')
+            article = getContext(obj).article
+            wikiurl = getattr(article, 'wikiurl', '')
             article_id = self.buildArticleID(wikiurl, obj.full_target)
-            if article_id in self.articleids:
+            if article_id in self._articleid_set:
                 internallink = True
 
         if not href:
@@ -1325,8 +1710,7 @@ class RlWriter(object):
     def svg2png(self, img_path ):
         cmd = ["convert", img_path, "-flatten", "-coalesce",  "-strip", img_path+".png"]
         try:
-            p = subprocess.Popen(cmd, shell=False)
-            pid, status = os.waitpid(p.pid, 0)
+            status, output = executor.run(cmd)
             if status != 0 :
                 log.warning('img could not be converted. convert exited with non-zero return code:', repr(cmd))
                 return ''
@@ -1336,13 +1720,15 @@ class RlWriter(object):
             log.warning('img could not be converted. cmd failed:', repr(cmd))
             return ''
 
-    def getImgPath(self, target):
+    def getImgPath(self, target, vector=False):
+        """vector: keep SVGs that can be embedded as drawings, see getSvgDrawing"""
         if self.imgDB:
             imgPath = self.imgDB.getDiskPath(target, size=800) # FIXME: width should be obsolete now
             if imgPath and imgPath.lower().endswith('svg'):
-                imgPath = self.svg2png(imgPath)
+                if not (vector and self.getSvgDrawing(imgPath)):
+                    imgPath = self.svg2png(imgPath)
             if imgPath:
-                imgPath = imgPath.encode('utf-8')
+                imgPath = self.image_registry.canonicalPath(imgPath.encode('utf-8'))
                 self.tmpImages.add(imgPath)
             if not self.license_checker.displayImage(target):
                 if self.debug:
@@ -1352,19 +1738,65 @@ class RlWriter(object):
             imgPath = ''
         return imgPath
 
+    def _prepareImage(self, img_node):
+        """fetch and convert the image of img_node. returns (path, drawing, size)
+        or a tuple of Nones if the image can not be used"""
+        img_path = self.getImgPath(img_node.target, vector=not img_node.isInline())
+
+        if not img_path:
+            if img_node.target == None:
+                img_node.target = ''
+            log.warning('invalid image url (obj.target: %r)' % img_node.target)
+            return None, None, None
+
+        drawing = self.getSvgDrawing(img_path)
+        if drawing:
+            return img_path, drawing, (drawing[1].width, drawing[1].height)
+        try:
+            ret = self._fixBrokenImages(img_node, img_path)
+            if ret != 0:
+                return None, None, None
+        except:
+            import traceback
+            traceback.print_exc()
+            log.warning('image skipped')
+            return None, None, None
+        return img_path, None, self.image_info.getSize(img_path)
+
+    def getSvgDrawing(self, img_path):
+        if self.svg_renderer and img_path.lower().endswith('svg'):
+            return self.svg_renderer.getDrawing(img_path)
+        return None
+
+    def _imageDecodes(self, img_path, info):
+        """Decode the image once, so that broken images are dropped here and
+        do not fail the whole book in doc.build. JPEGs are decoded at 1/8 of
+        their size, which still reads all of their data."""
+        try:
+            img = PilImage.open(img_path)
+            if info.format == 'JPEG':
+                img.draft(img.mode, (max(1, img.size[0]//8), max(1, img.size[1]//8)))
+            img.load()
+        except Exception: # PIL raises IOError, SyntaxError, struct.error etc.
+            return False
+        return True
+
     def _fixBrokenImages(self, img_node, img_path):
         if img_path in self.fixed_images:
             return self.fixed_images[img_path]
         self.fixed_images[img_path]=-1
 
         try:
-            img = PilImage.open(img_path)
-        except IOError:
+            info = self.image_info.getInfo(img_path)
+        except (IOError, OSError):
             log.warning('image can not be opened by PIL: %r' % img_path)
             return -1
-        if not isinstance(img.info.get('transparency', 0), int):
+        if not isinstance(info.transparency or 0, int):
             log.warning('image contains invalid transparency info - skipping')
             return -1
+        if not self._imageDecodes(img_path, info):
+            log.warning('image is truncated or corrupt - skipping: %r' % img_path)
+            return -1
         cmds = []
         base_cmd = [
             'convert',
@@ -1373,11 +1805,12 @@ class RlWriter(object):
             '-limit', 'disk', '64000000',
             '-limit', 'area', '64000000',
             ]
-        if img.info.get('interlace', 0) == 1:
+        if info.interlaced:
             cmds.append(base_cmd + [img_path, '-interlace', 'none', img_path])
-        if img.mode == 'P': # ticket 324
+        if info.mode == 'P': # ticket 324
             cmds.append(base_cmd + [img_path, img_path]) # we esentially do nothing...but this seems to fix the problems
-        if img.mode == 'LA': # ticket 429
+        if info.mode == 'LA': # ticket 429
+            img = PilImage.open(img_path)
             cleaned = PilImage.new('LA', img.size)
             new_data = []
             for pixel in img.getdata():
@@ -1387,8 +1820,8 @@ class RlWriter(object):
                     new_data.append(pixel)
             cleaned.putdata(new_data)
             cleaned.save(img_path)
-            img = PilImage.open(img_path)
-        if img.mode == 'RGBA':
+            del img
+        if info.mode == 'RGBA':
             # ticket 901, image: http://en.wikipedia.org/wiki/File:WiMAXArchitecture.svg
             #correct preserving alpha:
             #convert broken.png white1000.png -compose Multiply -composite +matte final.png
@@ -1400,25 +1833,27 @@ class RlWriter(object):
 
         for cmd in cmds:
             try:
-                ret = subprocess.call(cmd)
+                ret, output = executor.run(cmd)
                 if ret != 0:
                     log.warning("converting broken image failed (return code: %d): %r" % (ret, img_path))
                     return ret
             except OSError:
                 log.warning("converting broken image failed (OSError): %r" % img_path)
                 raise
-        try:
-            del img
-            img = PilImage.open(img_path)
-            d = img.load()
-        except:
-            log.warning('image can not be opened by PIL: %r' % img_path)
-            raise
+        # JPEGs are embedded as they are, everything else is decoded by
+        # reportlab later on and needs to be checked now
+        if cmds or info.format != 'JPEG':
+            try:
+                img = PilImage.open(img_path)
+                d = img.load()
+            except:
+                log.warning('image can not be opened by PIL: %r' % img_path)
+                raise
         self.fixed_images[img_path]=0
         return 0
 
     def set_svg_default_size(self, img_node):
-        image_info = self.imgDB.imageinfo.get(img_node.full_target, {})
+        image_info = self.getImageMeta().getImageInfo(img_node.full_target)
         if image_info.get('url', '').endswith('.svg'):
             w = image_info.get('width')
             h = image_info.get('height')
@@ -1433,29 +1868,20 @@ class RlWriter(object):
                 items.extend(self.write(node))
             return items
 
-        img_path = self.getImgPath(img_node.target)
-
-        if not img_path:
-            if img_node.target == None:
-                img_node.target = ''
-            log.warning('invalid image url (obj.target: %r)' % img_node.target)
-            return []
-
+        self.report.count('images')
+        phase = self.report.startPhase('images')
         try:
-            ret = self._fixBrokenImages(img_node, img_path)
-            if ret != 0:
-                return []
-        except:
-            import traceback
-            traceback.print_exc()
-            log.warning('image skipped')
+            img_path, drawing, img_size = self._prepareImage(img_node)
+        finally:
+            self.report.endPhase(phase)
+        if not img_path:
             return []
 
         max_width = self.colwidth
         if self.table_nesting > 0 and not max_width:
-            cell = img_node.getParentNodesByClass(advtree.Cell)
-            if cell:
-                max_width = print_width / len(cell[0].getAllSiblings()) - 10
+            cells = getContext(img_node).cells
+            if cells:
+                max_width = print_width / len(cells[0].getAllSiblings()) - 10
         max_height = pdfstyles.img_max_thumb_height * pdfstyles.print_height
         if self.table_nesting > 0:
             max_height = print_height/4 # fixme this needs to be read from config
@@ -1464,12 +1890,13 @@ class RlWriter(object):
 
         self.set_svg_default_size(img_node)
 
-        w, h = self.image_utils.getImageSize(img_node, img_path, max_print_width=max_width, max_print_height=max_height)
+        w, h = self.image_utils.getImageSize(img_node, img_size=img_size,
+                                             max_print_width=max_width, max_print_height=max_height)
 
         align = img_node.align
         if align in [None, 'none']:
-            align = styleutils.getTextAlign(img_node)
-        if advtree.Center in [ p.__class__ for p in img_node.getParents()]:
+            align = getTextAlign(img_node)
+        if getContext(img_node).centered:
             align = 'center'
         txt = []
         if img_node.render_caption:
@@ -1478,7 +1905,7 @@ class RlWriter(object):
         is_inline = img_node.isInline()
 
         if pdfstyles.link_images:
-            url = self.imgDB.getDescriptionURL(img_node.target) or self.imgDB.getURL(img_node.target)
+            url = self.getImageMeta().getURL(img_node.target)
         else:
             url = None
 
@@ -1492,20 +1919,22 @@ class RlWriter(object):
         img_name = img_node.target
         if not self.img_meta_info.get(img_name):
             self.img_count += 1
-            url = self.imgDB.getDescriptionURL(img_name) or self.imgDB.getURL(img_name)
+            url = self.getImageMeta().getURL(img_name)
             if url and pdfstyles.link_images:
                 url = unicode(urllib.unquote(url.encode('utf-8')), 'utf-8')
             else:
                 url = ''
             if not self.test_mode:
-                license_name = self.license_checker.getLicenseDisplayName(img_name)
-                contributors = self.imgDB.getContributors(img_node.target)
+                license_name = self.license_checker.getLicenseDisplayName(img_name) # memoized by the checker
+                contributors = self.getImageMeta().getContributors(img_node.target)
             else:
                 license_name = ''
                 contributors = ''
             self.img_meta_info[img_name] = (self.img_count, img_name, url, license_name, contributors)
 
         if is_inline:
+            if pdfstyles.img_target_dpi:
+                img_path = self.image_cache.fitImage(img_path, w, h, pdfstyles.img_target_dpi, recompress=True)
             txt = '%(linkstart)s<img src="%(src)s" width="%(width)fpt" height="%(height)fpt" valign="%(align)s"/>%(linkend)s' % {
                 'src': unicode(img_path, 'utf-8'),
                 'width': w,
@@ -1525,7 +1954,9 @@ class RlWriter(object):
                         padding=(0.2*cm, 0.2*cm, 0.2*cm, 0.2*cm),
                         borderColor=pdfstyles.img_border_color,
                         align=align,
-                        url=url)
+                        url=url,
+                        image_cache=self.image_cache,
+                        drawing=drawing)
         figure.float_figure = not img_node.align in ['center', 'none']
         return [figure]
 
@@ -1536,7 +1967,7 @@ class RlWriter(object):
             perrow = int(obj.attributes.get('perrow', ''))
         except ValueError:
             perrow = None
-        num_images = len(obj.getChildNodesByClass(advtree.ImageLink))
+        num_images = self.countDescendants(obj, advtree.ImageLink)
         if num_images == 0:
             return []
         if not perrow:
@@ -1603,64 +2034,56 @@ class RlWriter(object):
             return [table]
 
 
+    # markup-aware tokens of preformatted text: runs of blanks outside of
+    # tags and "words", i.e. everything else including complete tags
+    _frag_re = re.compile('[ \t]+|(?:<[^>]*>?|[^ \t<])+')
+    _markup_re = re.compile('<[^>]*>?|>')
+
     def _len(self, txt):
-        in_tag = False
-        length = 0
-        for c in txt:
-            if c == '<':
-                in_tag = True
-            elif c == '>':
-                in_tag = False
-            elif not in_tag:
-                length += 1
-        return length
+        return len(self._markup_re.sub('', txt))
 
     def _getFrags(self, txt):
-        #Words = re.findall('([ \t]+|[^ \t]+)', txt)
-        words = []
-        word = []
-        in_tag = False
-        in_space = False
-        for c in txt:
-            if c == '<':
-                in_tag = True
-            if c in [' ', '\t']:
-                if not in_tag:
-                    if not in_space:
-                        words.append(''.join(word))
-                        word = []
-                word.append(c)
-                in_space = True
-            else:
-                if in_space and not in_tag:
-                    words.append(''.join(word))
-                    word = []
-                word.append(c)
-                in_space = False
-            if c == '>':
-                in_tag = False
-        if word:
-            words.append(''.join(word))
-        return words
+        return self._frag_re.findall(txt)
 
     def breakLongLines(self, txt, char_limit):
-       broken_source = []
-       for line in txt.split('\n'):
-           if len(line) < char_limit:
-               broken_source.append(line)
-           else:
-               words = self._getFrags(line)
-               while words:
-                   new_line = [words.pop(0)]
-                   while words and (self._len(''.join(new_line)) + self._len(words[0])) < char_limit:
-                       new_line.append(words.pop(0))
-                   broken_source.append(''.join(new_line))
-       return '\n'.join(broken_source)
-
+        broken_source = []
+        for line in txt.split('\n'):
+            if len(line) < char_limit:
+                broken_source.append(line)
+                continue
+            words = self._getFrags(line)
+            lengths = [self._len(word) for word in words]
+            num_words = len(words)
+            i = 0
+            while i < num_words:
+                start = i
+                line_len = lengths[i]
+                i += 1
+                while i < num_words and line_len + lengths[i] < char_limit:
+                    line_len += lengths[i]
+                    i += 1
+                broken_source.append(''.join(words[start:i]))
+        return '\n'.join(broken_source)
+
+
+    def _highlightSource(self, source, lexer, font_size):
+        sourceFormatter = getSourceFormatter(font_size)
+        if not self.source_cache:
+            return unicode(highlight(source, lexer, sourceFormatter), 'utf-8')
+        key = self.source_cache.makeKey(source,
+                                        lexer.__class__.__name__,
+                                        sourceFormatter.style.__name__,
+                                        sourceFormatter.font_name,
+                                        sourceFormatter.background_color,
+                                        font_size,
+                                        pygments.__version__)
+        txt = self.source_cache.get(key)
+        if txt is None:
+            txt = highlight(source, lexer, sourceFormatter)
+            self.source_cache.set(key, txt)
+        return unicode(txt, 'utf-8')
 
     def _writeSourceInSourceMode(self, n, src_lang, lexer, font_size):
-        sourceFormatter = ReportlabFormatter(font_size=font_size, font_name='FreeMono', background_color='#eeeeee', line_numbers=False)
-        sourceFormatter.encoding = 'utf-8'
         self.formatter.source_mode += 1
 
         source = ''.join(self.renderInline(n))
@@ -1673,45 +2096,37 @@ class RlWriter(object):
             source = self.breakLongLines(source, char_limit)
         txt = ''
         try:
-            txt = unicode(highlight(source, lexer, sourceFormatter), 'utf-8')
+            txt = self._highlightSource(source, lexer, font_size)
             self.font_switcher.registerDefaultFont(pdfstyles.default_latin_font)
             txt = self.font_switcher.fontifyText(txt)
             self.font_switcher.registerDefaultFont(pdfstyles.default_font)
             if n.vlist.get('enclose', False) == 'none':
                 txt = re.sub('<para.*?>', '', txt).replace('</para>', '')
                 return txt
-            return XPreformatted(txt, text_style(mode='source', in_table=self.table_nesting))
+            return LinePreformatted(txt, text_style(mode='source', in_table=self.table_nesting))
         except:
             traceback.print_exc()
             log.error('unsuitable lexer for source code language: %s - Lexer: %s' % (repr(src_lang), lexer.__class__.__name__))
             return None
 
+    def _setSourceFontSize(self, txt, font_size):
+        """change the font size of highlighted source code w/o highlighting it again"""
+        return re.sub('(<font name="[^"]*" size=")[^"]*(")', r'\g<1>%g\2' % font_size, txt, 1)
+
     def writeSource(self, n):
-        langMap = {'lisp': lexers.CommonLispLexer()} #custom Mapping between mw-markup source attrs to pygement lexers if get_lexer_by_name fails
-        def getLexer(name):
-            try:
-                return lexers.get_lexer_by_name(name)
-            except lexers.ClassNotFound:
-                lexer = langMap.get(name)
-                if lexer:
-                    return lexer
-                else:
-                    traceback.print_exc()
-                    log.error('unknown source code language: %s' % repr(name))
-                    return None
         src_lang = n.vlist.get('lang', '').lower()
         lexer = getLexer(src_lang)
         if lexer:
             rtl, self.rtl = self.rtl, False
-            width = None
-            avail_width = self.getAvailWidth()
             font_size = pdfstyles.font_size
-            while not width or width > avail_width:
-                res = self._writeSourceInSourceMode(n, src_lang, lexer, font_size)
-                if res.__class__ != XPreformatted:
-                    break
+            res = self._writeSourceInSourceMode(n, src_lang, lexer, font_size)
+            if isinstance(res, LinePreformatted):
+                avail_width = self.getAvailWidth()
                 width, height = res.wrap(avail_width, pdfstyles.page_height)
-                font_size -= .5
+                if width > avail_width:
+                    font_size = max(0.5, self._fitFontSize(font_size, width, avail_width,
+                                                           res.style.leftIndent + res.style.rightIndent))
+                    res = LinePreformatted(self._setSourceFontSize(res.text, font_size), res.style)
             self.rtl = rtl
             if res:
                 return [res]
@@ -1776,7 +2191,7 @@ class RlWriter(object):
                 if height:
                     return [Spacer(0, height)]
             return []
-        if getattr(n, 'border', False) and not n.getParentNodesByClass(Table) and not n.getChildNodesByClass(advtree.PreFormatted):
+        if getattr(n, 'border', False) and not n.getParentNodesByClass(Table) and not self.countDescendants(n, advtree.PreFormatted):
             return self.renderMixed(n, text_style(mode='box', indent_lvl=self.paraIndentLevel, in_table=self.table_nesting))
         else:
             return self.renderMixed(n, text_style(indent_lvl=self.paraIndentLevel, in_table=self.table_nesting))
@@ -1906,12 +2321,12 @@ class RlWriter(object):
         return elements
 
     def _extraCellPadding(self, cell):
-        return cell.getChildNodesByClass(advtree.NamedURL) \
-               or cell.getChildNodesByClass(advtree.Reference) \
-               or cell.getChildNodesByClass(advtree.Sup)
+        return self.countDescendants(cell, advtree.NamedURL) \
+               or self.countDescendants(cell, advtree.Reference) \
+               or self.countDescendants(cell, advtree.Sup)
 
     def renderCell(self, cell):
-        align = styleutils.getTextAlign(cell)
+        align = getTextAlign(cell)
         if not align and getattr(cell, 'is_header', False) \
                or all([item.__class__ == advtree.ImageLink for item in cell.children]):
             align = 'center'
@@ -2067,6 +2482,7 @@ class RlWriter(object):
     def writeTable(self, t):
         if self.emptyTable(t):
             return []
+        self.report.count('tables')
         self.table_nesting += 1
         elements = []
         if len(t.children) >= pdfstyles.min_rows_for_break and self.table_nesting == 1:
@@ -2127,7 +2543,25 @@ class RlWriter(object):
         if c:
             c.pop()
 
+    def _renderMath(self, source, density):
+        # same as mathutils.renderMath with texvc, but run through the executor
+        if not mathutils.texvc_available:
+            return None
+        cmd = ['texvc', self.tmpdir, self.tmpdir, source.encode('utf-8'), 'UTF-8', str(density)]
+        try:
+            ret, result = executor.run(cmd, quiet=True)
+        except OSError:
+            log.error('error with texvc. cmd:', repr(' '.join(cmd)))
+            return None
+        if len(result) >= 32:
+            png_fn = os.path.join(self.tmpdir, result[1:33] + '.png')
+            if os.path.exists(png_fn):
+                return png_fn
+        log.error('error converting math (texvc). source: %r \nerror: %r' % (source, result))
+        return None
+
     def writeMath(self, node):
+        self.report.count('formulas')
         source = re.compile(u'\n+').sub(u'\n', node.caption.strip()) # remove multiple newlines, as this could break the mathRenderer
         if not len(source):
             return []
@@ -2152,7 +2586,9 @@ class RlWriter(object):
                 imgpath = cached_path
 
         if not imgpath:
-            imgpath = writerbase.renderMath(source, output_path=self.tmpdir, output_mode='png', render_engine='texvc', resolution_in_dpi=density)
+            phase = self.report.startPhase('math')
+            imgpath = self._renderMath(source, density)
+            self.report.endPhase(phase)
             if not imgpath:
                 return []
             if has_cache():
@@ -2161,11 +2597,9 @@ class RlWriter(object):
                 shutil.move(imgpath, cached_path)
                 imgpath = cached_path
 
-        img = PilImage.open(imgpath)
         if self.debug:
             log.info("math png at:", imgpath)
-        w,h = img.size
-        del img
+        w, h = self.image_info.getSize(imgpath)
 
         if w > pdfstyles.max_math_width or h > pdfstyles.max_math_height:
             log.info('skipping math formula, png to big: %r, w:%d, h:%d' % (source, w, h))
@@ -2197,7 +2631,7 @@ class RlWriter(object):
             node.width = 180
             node.thumb = True
             node.isInline = lambda : False
-            w, h = self.image_utils.getImageSize(node, img_path)
+            w, h = self.image_utils.getImageSize(node, img_size=self.image_info.getSize(img_path))
             return [Figure(img_path, '', text_style(), imgWidth=w, imgHeight=h)]
         return []
 
@@ -2215,10 +2649,14 @@ def writer(env, output,
     mathcache=None,
     lang=None,
     profile=None,
+    cachedir=None,
+    report=None,
+    nodetimes=None,
 ):
 
 
-    r = RlWriter(env, strict=strict, debug=debug, mathcache=mathcache, lang=lang)
+    r = RlWriter(env, strict=strict, debug=debug, mathcache=mathcache, lang=lang, cachedir=cachedir, report=report,
+                 nodetimes=nodetimes)
     if coverimage is None and env.configparser.has_section('pdf'):
         coverimage = env.configparser.get('pdf', 'coverimage', None)
 
@@ -2249,6 +2687,10 @@ writer.options = {
         'param': 'DIRNAME',
         'help': 'directory of cached math images',
     },
+    'cachedir': {
+        'param': 'DIRNAME',
+        'help': 'directory for rendering results that can be shared between jobs',
+    },
     'lang': {
         'param': 'LANGUAGE',
         'help': 'use translated strings in given language (defaults to "en" for English)',
@@ -2257,4 +2699,12 @@ writer.options = {
         'param': 'PROFILEFN',
         'help': 'profile run time. ONLY for debugging purposes',
     },
+    'report': {
+        'param': 'FILENAME',
+        'help': 'write time and memory usage per rendering phase and article as JSON',
+    },
+    'nodetimes': {
+        'param': 'FILENAME',
+        'help': 'write the time spent per node type and article as table and as FILENAME.folded for flame graphs',
+    },
 }
@@ -0,0 +1,51 @@
+#! /usr/bin/env python
+#! -*- coding:utf-8 -*-
+
+# Copyright (c) 2007, PediaPress GmbH
+# See README.txt for additional licensing information.
+
+try:
+    from svglib.svglib import svg2rlg
+except ImportError:
+    svg2rlg = None
+
+from mwlib import log
+from mwlib.rl.imagecache import contentHash
+
+log = log.Log('rlwriter')
+
+
+class SvgRenderer(object):
+    """Converts SVG images to reportlab drawings (using svglib).
+
+    Drawings are kept per content hash. SVGs which can not be converted
+    are remembered as well, they are rasterized by the caller instead.
+    """
+
+    def __init__(self):
+        self.drawings = {} # content hash -> (form name, drawing) or None
+
+    def available(self):
+        return svg2rlg is not None
+
+    def getDrawing(self, path):
+        """Return (form_name, drawing) for the SVG at path or None if it
+        can not be converted. form_name identifies the drawing within
+        a PDF document."""
+        if svg2rlg is None:
+            return None
+        try:
+            digest = contentHash(path)
+        except (IOError, OSError):
+            return None
+        if digest not in self.drawings:
+            try:
+                drawing = svg2rlg(path)
+            except Exception, exc: # svglib raises anything on malformed input
+                log.warning('svg can not be converted: %r: %r' % (path, exc))
+                drawing = None
+            if drawing is not None and drawing.width > 0 and drawing.height > 0:
+                self.drawings[digest] = ('SVG%s' % digest, drawing)
+            else:
+                self.drawings[digest] = None
+        return self.drawings[digest]
@@ -5,7 +5,6 @@
 # See README.txt for additional licensing information.
 
 import os
-import subprocess
 import shutil
 
 import mwlib.ext
@@ -15,6 +14,7 @@ from reportlab.platypus.tables import Table
 
 from mwlib.rl import pdfstyles
 from mwlib.rl import fontconfig
+from mwlib.rl.executor import executor
 
 
 class TocRenderer(object):
@@ -68,7 +68,7 @@ class TocRenderer(object):
 
     def run_cmd(self, cmd):
         try:
-            retcode = subprocess.call(cmd, stdout=subprocess.PIPE)
+            retcode, output = executor.run(cmd)
         except OSError:
             retcode = 1
         return retcode
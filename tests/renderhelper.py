@@ -86,3 +86,11 @@ class dummyImageDB(object):
 
     def getURL(self, name):
         return None
+
+def writer(**kwargs):
+    return RlWriter(test_mode=True, **kwargs)
+
+def parseArticle(raw, title='Test'):
+    art = uparser.parseString(title=title, raw=raw)
+    advtree.buildAdvancedTree(art)
+    return art
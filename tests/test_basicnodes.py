@@ -60,6 +60,11 @@ def test_preformatted():
     
     renderMW(txt, 'preformatted')
 
+def test_long_preformatted():
+    lines = '\n'.join('line %d of a long listing' % i for i in range(300))
+    renderMW('<pre>%s</pre>' % lines, 'long_preformatted')
+    renderMW('<source lang="python">%s</source>' % lines, 'long_source')
+
 def test_indented():
     txt = 'normal paragraph\n\n: some indented text\n\nback to normal'
     renderMW(txt, 'indented')
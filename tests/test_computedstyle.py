@@ -0,0 +1,24 @@
+#! /usr/bin/env py.test
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2007-2008 PediaPress GmbH
+# See README.txt for additional licensing information.
+
+from mwlib import advtree
+from mwlib.writer import styleutils
+from mwlib.rl import computedstyle
+
+from renderhelper import writer, parseArticle
+
+def test_computed_style():
+    raw = u'<div style="color:red; text-align:center">a <span style="color:#00f">b</span> <div align="right" style="background-color:yellow">c <div style="text-align:foo">d</div></div></div>\n{|\n|-\n! e\n| f\n|}'
+    art = parseArticle(raw)
+    r = writer()
+    r.prepareWrite(art)
+    for node in art.allchildren():
+        computed = computedstyle.getComputedStyle(node)
+        assert computed.color == styleutils.rgbColorFromNode(node)
+        assert computed.background == styleutils.rgbBgColorFromNode(node)
+        assert computedstyle.getTextAlign(node) == styleutils.getTextAlign(node)
+    span = art.getChildNodesByClass(advtree.Span)[0]
+    assert r.formatter.compileCssStyle(span) == (('set', 'color_style', (0, 0, 1)),)
@@ -0,0 +1,57 @@
+#! /usr/bin/env py.test
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2007-2008 PediaPress GmbH
+# See README.txt for additional licensing information.
+
+import re
+from cStringIO import StringIO
+
+import pytest
+
+import mwlib.ext
+from reportlab.graphics.shapes import Drawing, Rect
+from reportlab.platypus.doctemplate import SimpleDocTemplate
+
+from mwlib.rl.customflowables import LinePreformatted, Figure
+from mwlib.rl.pdfstyles import text_style
+
+from renderhelper import writer
+
+@pytest.fixture(autouse=True, scope='module')
+def fonts():
+    writer() # registers the fonts of the text styles
+
+def test_line_preformatted_split():
+    style = text_style(mode='preformatted')
+    lines = ['line %d' % i for i in range(200)]
+    pre = LinePreformatted('\n'.join(lines), style)
+    w, h = pre.wrap(400, 1000)
+    pieces = []
+    while True:
+        pre.wrap(400, 100)
+        res = pre.split(400, 100)
+        if len(res) < 2:
+            pieces.append(pre)
+            break
+        first, pre = res
+        assert first._lines is pre._lines # line array is shared
+        pieces.append(first)
+    assert pieces[0]._start == 0 and pieces[-1]._stop == len(lines)
+    for p1, p2 in zip(pieces, pieces[1:]):
+        assert p1._stop == p2._start
+    assert abs(sum(p.wrap(400, 100)[1] for p in pieces) - h) < 1e-6
+
+def test_drawing_figure():
+    d = Drawing(200, 100)
+    d.add(Rect(10, 10, 180, 80))
+    figures = [Figure('dummy.svg', 'caption', text_style('figure'), imgWidth=w, imgHeight=w/2.0, drawing=('SVGtest', d))
+               for w in (100, 200, 300)]
+    out = StringIO()
+    SimpleDocTemplate(out).build(figures)
+    assert len(re.findall('/Subtype /Form', out.getvalue())) == 1 # drawn once, placed three times
+
+def test_line_preformatted_split_at_end():
+    pre = LinePreformatted('\n'.join(['line %d' % i for i in range(10)]), text_style(mode='preformatted'))
+    w, h = pre.wrap(400, 1000)
+    assert pre.split(400, h) == [pre] # no empty trailing piece
@@ -0,0 +1,43 @@
+#! /usr/bin/env py.test
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2007-2008 PediaPress GmbH
+# See README.txt for additional licensing information.
+
+import fcntl
+import os
+import threading
+import time
+
+import pytest
+
+from mwlib.rl import pdfstyles
+from mwlib.rl.executor import Executor
+
+@pytest.fixture
+def executor(tmpdir, monkeypatch):
+    monkeypatch.setattr(pdfstyles, 'tool_slot_dir', str(tmpdir))
+    monkeypatch.setitem(pdfstyles.tool_limits, 'sleepy', (1, 0.5, 1))
+    return Executor()
+
+def test_run(executor):
+    assert executor.run(['sh', '-c', 'echo hello; echo noise >&2'], quiet=True) == (0, 'hello\n')
+    with pytest.raises(OSError):
+        executor.run(['no-such-tool-here'])
+    assert executor.stats['no-such-tool-here'].failures == 1
+
+def test_timeout(executor):
+    t = time.time()
+    ret, output = executor.run(['sh', '-c', 'sleep 10 & sleep 10'], tool='sleepy')
+    assert ret < 0 and time.time() - t < 5
+    assert executor.stats['sleepy'].timeouts == 1
+
+def test_slots(executor, tmpdir):
+    # the slots are flock'ed files, like the ones of other render processes
+    executor.run(['true'], tool='sleepy')
+    fd = os.open(str(tmpdir.join('sleepy.0.lock')), os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    threading.Timer(0.3, os.close, (fd,)).start()
+    t = time.time()
+    executor.run(['true'], tool='sleepy')
+    assert time.time() - t >= 0.3
@@ -0,0 +1,64 @@
+#! /usr/bin/env py.test
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2007-2008 PediaPress GmbH
+# See README.txt for additional licensing information.
+
+import os
+
+from PIL import Image
+
+from mwlib.rl.imagecache import ImageCache, ImageRegistry, ImageInfoIndex
+
+def test_image_cache(tmpdir):
+    tmpdir = str(tmpdir)
+    cache = ImageCache(os.path.join(tmpdir, 'cache'))
+    photo = os.path.join(tmpdir, 'photo.png')
+    Image.frombytes('RGB', (1500, 1000), os.urandom(1500*1000*3)).save(photo)
+    res = cache.fitImage(photo, 144, 144, 50) # 2 inch at 50dpi
+    assert res.endswith('.jpg')
+    assert Image.open(res).size == (100, 67)
+    assert cache.fitImage(photo, 144, 144, 50) == res
+    assert cache.fitImage(photo, 144*20, 144*20, 50) == photo # never upscaled
+    res = cache.fitImage(photo, 144*20, 144*20, 50, recompress=True)
+    assert res.endswith('.jpg') and Image.open(res).size == (1500, 1000)
+    drawing = os.path.join(tmpdir, 'drawing.png')
+    Image.new('RGB', (3000, 2000), (255, 0, 0)).save(drawing)
+    res = cache.fitImage(drawing, 144, 144, 100)
+    assert res.endswith('.png') and Image.open(res).size == (200, 133)
+    assert cache.fitImage(drawing, 144*20, 144*20, 100, recompress=True) == drawing
+
+def test_image_cache_alpha(tmpdir):
+    tmpdir = str(tmpdir)
+    cache = ImageCache(os.path.join(tmpdir, 'cache'))
+    alpha = os.path.join(tmpdir, 'alpha.png')
+    Image.new('RGBA', (1000, 1000)).save(alpha)
+    res = cache.fitImage(alpha, 72, 72, 100)
+    assert res.endswith('.png') and Image.open(res).mode == 'RGBA'
+    keyed = os.path.join(tmpdir, 'keyed.png')
+    Image.frombytes('RGB', (500, 500), os.urandom(500*500*3)).save(keyed, transparency=(0, 0, 0))
+    res = cache.fitImage(keyed, 72, 72, 100)
+    assert res.endswith('.png') and Image.open(res).mode == 'RGBA'
+    assert cache.fitImage(keyed, 144*20, 144*20, 100, recompress=True) == keyed
+
+def test_image_registry(tmpdir):
+    paths = [str(tmpdir.join(name)) for name in ('a.png', 'b.png', 'c.png')]
+    for path, data in zip(paths, ('flag', 'flag', 'icon')):
+        open(path, 'wb').write(data)
+    reg = ImageRegistry()
+    assert [reg.canonicalPath(p) for p in paths + paths] == [paths[0], paths[0], paths[2]]*2
+    assert len(reg.paths) == 2
+    assert reg.references == 6
+    assert reg.bytes_saved == 4 # b.png is only counted once
+
+def test_image_info_index(tmpdir):
+    path = str(tmpdir.join('img.png'))
+    Image.new('P', (30, 20)).save(path, transparency=0)
+    index = ImageInfoIndex()
+    info = index.getInfo(path)
+    assert index.getInfo(path) is info
+    assert info.size == (30, 20) and info.mode == 'P' and info.format == 'PNG'
+    assert info.has_alpha and not info.interlaced
+    Image.new('L', (10, 10)).save(path)
+    os.utime(path, (0, 0)) # modified in place
+    assert index.getSize(path) == (10, 10)
@@ -0,0 +1,34 @@
+#! /usr/bin/env py.test
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2007-2008 PediaPress GmbH
+# See README.txt for additional licensing information.
+
+from mwlib.rl.imagemeta import ImageMetaIndex
+
+class ImageDB(object):
+    imageinfo = {'File:A.svg': '{"url": "http://x/A.svg", "width": 10}'}
+
+    def __init__(self):
+        self.calls = 0
+
+    def getDescriptionURL(self, name):
+        self.calls += 1
+        return None
+
+    def getURL(self, name):
+        return 'http://x/' + name
+
+    def getContributors(self, name):
+        self.calls += 1
+        return ['Bob']
+
+def test_image_meta_index():
+    db = ImageDB()
+    index = ImageMetaIndex(db)
+    assert index.getImageInfo(u'File:A.svg') == {'url': 'http://x/A.svg', 'width': 10}
+    assert index.getImageInfo(u'File:B.png') == {}
+    for i in range(3):
+        assert index.getURL('A.svg') == 'http://x/A.svg'
+        assert index.getContributors('A.svg') == ['Bob']
+    assert db.calls == 2
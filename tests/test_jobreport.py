@@ -0,0 +1,34 @@
+#! /usr/bin/env py.test
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2007-2008 PediaPress GmbH
+# See README.txt for additional licensing information.
+
+from mwlib.rl.jobreport import JobReport
+
+def test_job_report():
+    report = JobReport()
+    report.newAttempt()
+    for title in ('A', 'B', 'C'):
+        report.startArticle(title)
+        phase = report.startPhase('layout')
+        report.count('images')
+        report.endPhase(phase)
+        report.endArticle()
+    report.articles[1]['skipped'] = True
+    report.setPages(10, [('group', 'Articles', 1), ('article', 'A', 1), ('chapter', 'Ch', 3),
+                         ('article', 'C', 4), ('article', 'License', 9)])
+    assert [a['pages'] for a in report.articles] == [2, None, 5]
+    d = report.asDict()
+    assert d['phases']['layout']['calls'] == 3 and d['counters']['images'] == 3
+
+def test_untimed_job_report():
+    report = JobReport(timed=False)
+    report.startArticle('A')
+    phase = report.startPhase('images')
+    report.count('images')
+    report.endPhase(phase)
+    report.suspended = True
+    report.count('images')
+    assert report.counters['images'] == report.article['images'] == 1
+    assert report.phases == {} and report.article['phases'] == {}
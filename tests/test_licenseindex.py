@@ -0,0 +1,19 @@
+#! /usr/bin/env py.test
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2007-2008 PediaPress GmbH
+# See README.txt for additional licensing information.
+
+import pytest
+
+from mwlib.rl.licenseindex import getLicenseIndex
+
+from renderhelper import writer
+
+def test_license_index():
+    index = getLicenseIndex()
+    assert index is getLicenseIndex()
+    assert writer().license_checker.licenses is index
+    assert index['cc-by-sa-3.0'].license_type == 'free'
+    with pytest.raises(TypeError):
+        index['foo'] = None
@@ -0,0 +1,24 @@
+#! /usr/bin/env py.test
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2007-2008 PediaPress GmbH
+# See README.txt for additional licensing information.
+
+from mwlib import advtree
+from mwlib.rl.nodecontext import getContext
+
+from renderhelper import writer, parseArticle
+
+def test_ancestor_context():
+    art = parseArticle(u'<center>\n{|\n|-\n| a\n{|\n|-\n| [[b]]\n|}\n|}\n</center>\n\n[[c]]')
+    r = writer()
+    r.prepareWrite(art)
+    for link in art.getChildNodesByClass(advtree.ArticleLink):
+        context = getContext(link)
+        del link._context
+        fallback = getContext(link)
+        assert context.article is fallback.article is art
+        assert context.cells == fallback.cells == tuple(link.getParentNodesByClass(advtree.Cell))
+        assert context.tables == tuple(link.getParentNodesByClass(advtree.Table))
+        assert context.centered == fallback.centered == bool(link.getParentNodesByClass(advtree.Center))
+    assert [len(getContext(link).tables) for link in art.getChildNodesByClass(advtree.ArticleLink)] == [2, 0]
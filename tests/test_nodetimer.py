@@ -0,0 +1,20 @@
+#! /usr/bin/env py.test
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2007-2008 PediaPress GmbH
+# See README.txt for additional licensing information.
+
+from mwlib.rl.nodetimer import NodeTimer
+
+def test_node_timer():
+    timer = NodeTimer()
+    timer.setArticle(u'A;B')
+    for name in ('Table', 'Cell', 'Table', 'Cell'):
+        timer.enter(name)
+    for i in range(4):
+        timer.leave()
+    calls, incl, excl = timer.stats[(u'A,B', 'Table')]
+    assert calls == 2 and incl >= excl
+    assert set(line.rsplit(' ', 1)[0] for line in timer.getCollapsedStacks().split('\n')) == set([
+        u'A,B;Table', u'A,B;Table;Cell', u'A,B;Table;Cell;Table', u'A,B;Table;Cell;Table;Cell'])
+    assert len(timer.getTable().split('\n')) == 3
@@ -0,0 +1,30 @@
+#! /usr/bin/env py.test
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2007-2008 PediaPress GmbH
+# See README.txt for additional licensing information.
+
+from reportlab.platypus.flowables import PageBreak
+from reportlab.platypus.paragraph import Paragraph
+
+from mwlib.rl.pagetemplates import PPDocTemplate, WikiPage, NextPageTitle
+from mwlib.rl.pdfstyles import text_style
+
+from renderhelper import writer
+
+def test_page_titles(tmpdir):
+    writer() # registers fonts
+    doc = PPDocTemplate(str(tmpdir.join('test.pdf')), title='')
+    template = WikiPage()
+    doc.addPageTemplates(template)
+    titles = []
+    orig = template.afterDrawPage
+    def afterDrawPage(canvas, doc):
+        titles.append(doc.page_title)
+        orig(canvas, doc)
+    template.afterDrawPage = afterDrawPage
+    doc.build([NextPageTitle(u'A'), Paragraph('a', text_style()), PageBreak(),
+               Paragraph('a', text_style()), NextPageTitle(u'B'), PageBreak(),
+               Paragraph('b', text_style())])
+    assert titles == [u'A', u'A', u'B']
+    assert [t.id for t in doc.pageTemplates] == ['WikiPage']
@@ -0,0 +1,187 @@
+#! /usr/bin/env py.test
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2007-2008 PediaPress GmbH
+# See README.txt for additional licensing information.
+
+import copy
+import os
+import cPickle as pickle
+
+from PIL import Image
+
+from mwlib import advtree
+from mwlib.rl import rlwriter
+from mwlib.rl.customflowables import LinePreformatted
+from mwlib.rl.pdfstyles import text_style
+from reportlab.platypus.doctemplate import NotAtTopPageBreak
+from reportlab.platypus.flowables import CondPageBreak
+
+from renderhelper import writer, parseArticle
+
+def test_fit_preformatted():
+    r = writer()
+    for raw, klass in [('<pre>%s</pre>' % ('x' * 120), advtree.PreFormatted),
+                       ('<source lang="python">a = "%s"</source>' % ('y' * 95), advtree.Source)]:
+        node = parseArticle(raw).getChildNodesByClass(klass)[0]
+        pre = r.write(node)[0]
+        avail_width = r.getAvailWidth()
+        w, h = pre.wrap(avail_width, 1000)
+        assert w <= avail_width
+        # only one line, i.e. the text has been scaled, not broken
+        assert len(pre.blPara.lines) <= 2
+
+def test_fit_indented_preformatted():
+    r = writer()
+    style = text_style(mode='preformatted')
+    style.leftIndent, style.rightIndent = 40, 20
+    avail_width = 300
+    w, h = LinePreformatted('x' * 150, style).wrap(avail_width, 1000)
+    style.fontSize = r._fitFontSize(style.fontSize, w, avail_width, 60)
+    w, h = LinePreformatted('x' * 150, style).wrap(avail_width, 1000)
+    assert w <= avail_width
+
+def test_source_cache(tmpdir):
+    raw = '<source lang="python">def f(x):\n    return x</source>'
+    res = []
+    for i in range(2):
+        r = writer(cachedir=str(tmpdir))
+        node = parseArticle(raw).getChildNodesByClass(advtree.Source)[0]
+        res.append(r.write(node)[0].text)
+    assert res[0] == res[1]
+    entries = [fn for dirpath, dirnames, fns in os.walk(str(tmpdir)) for fn in fns]
+    assert len(entries) == 1
+
+def test_breakLongLines():
+    r = writer()
+    txt = '<font name="x">%s</font> %s' % (' '.join(['abc'] * 10), 'y' * 30)
+    res = r.breakLongLines(txt, 10).split('\n')
+    assert ''.join(res) == txt
+    for line in res[:-1]:
+        assert r._len(line) < 10
+    assert res[-1] == 'y' * 30 # words are never broken
+    assert r._len('<b>a b</b>&gt;') == 7
+
+def test_write_info():
+    art = parseArticle(u'<div style="page-break-before:always; page-break-after:30%" dir="rtl">x</div>\n\nplain text')
+    r = writer()
+    r.prepareWrite(art)
+    div = art.getChildNodesByClass(advtree.Div)[0]
+    assert div._write_info[:3] == (True, 'always', 0.3)
+    assert art.getChildNodesByClass(advtree.Text)[-1]._write_info is None
+    res = r.write(div)
+    assert isinstance(res[0], NotAtTopPageBreak) and isinstance(res[-1], CondPageBreak)
+    assert r.rtl == False
+
+def test_descendant_counts():
+    art = parseArticle(u'<div>a<sup>1</sup> <math>x^2</math> <div><math>a+b+c</math><sup>2</sup></div></div>\n\ntext')
+    r = writer()
+    r.prepareWrite(art)
+    for node in [art] + art.getChildNodesByClass(advtree.Div):
+        for klass in (advtree.Sup, advtree.Math, advtree.ImageLink):
+            assert r.countDescendants(node, klass) == len(node.getChildNodesByClass(klass))
+        assert r.maxMathLength(node) == max([len(m.caption) for m in node.getChildNodesByClass(advtree.Math)] or [0])
+    assert r.maxMathLength(art) == 5
+
+def test_article_ids():
+    r = writer()
+    article_id = r.buildArticleID('http://en.wikipedia.org/w/', u'foo bar')
+    assert article_id == r._buildArticleID('http://en.wikipedia.org/w/', u'foo bar')
+    assert r.buildArticleID('http://en.wikipedia.org/w/', u'foo bar') is article_id
+    assert r.buildArticleID('http://de.wikipedia.org/w/', u'foo bar') != article_id
+
+def test_article_title():
+    r = writer()
+    assert r.renderArticleTitle(u'Foo (bar) & baz') == u'Foo (bar) &amp; baz'
+    assert r.renderArticleTitle(u"H<sub>2</sub>O ''x''") == r.renderArticleTitle(u"H<sub>2</sub>O ''x''") == u'H<sub>2</sub>O <i>x</i>'
+    size = len(rlwriter._title_cache)
+    r.renderArticleTitle(u'[[a]][[b]] c') # a link is left over, see cleanTitle
+    assert len(rlwriter._title_cache) == size
+    r.font_switcher.space_cjk = not r.font_switcher.space_cjk # as for another language
+    r.renderArticleTitle(u"H<sub>2</sub>O ''x''")
+    assert len(rlwriter._title_cache) == size + 1
+
+def test_license_cache():
+    r = writer()
+    r.license_mode = True
+    art = parseArticle(u"== Terms ==\nSome ''text''.\n\n== More ==\ntext", title='License')
+    body = r._getCachingBodyWriter('key')(art)
+    cached_body, bookmarks = pickle.loads(rlwriter._license_cache.get('key'))
+    assert [e.__class__ for e in cached_body] == [e.__class__ for e in body]
+    assert [b[2] for b in bookmarks] == ['license-key-0', 'license-key-1']
+    assert 'license-key-1' in cached_body[-2].text
+    r.bookmarks = [(u'Article', 'article')]
+    assert r._getCachedBodyWriter(cached_body, bookmarks)(art) is cached_body
+    assert r.bookmarks[1:] == bookmarks
+    art = parseArticle(u"See [http://example.com/terms the terms].", title='License')
+    r._getCachingBodyWriter('url-key')(art)
+    assert r.url_map and rlwriter._license_cache.get('url-key') is None # numbered per book
+
+def test_article_meta():
+    calls = []
+    class Source(object):
+        url = 'http://en.wikipedia.org/w/'
+    class Wiki(object):
+        def normalize_and_get_page(self, title, ns):
+            calls.append('page')
+        def getURL(self, title, revision=None):
+            calls.append('url')
+            return 'http://en.wikipedia.org/wiki/' + title
+        def getSource(self, title, revision=None):
+            calls.append('source')
+            return Source()
+        def getAuthors(self, title, revision=None):
+            calls.append('authors')
+            return [u'Alice']
+    class Item(object):
+        wiki = Wiki()
+        title = u'Foo'
+        revision = None
+    r = writer()
+    meta = r.getArticleMeta(Item())
+    assert (meta.ns, meta.url, meta.source.url, meta.authors) == (0, 'http://en.wikipedia.org/wiki/Foo', Source.url, [u'Alice'])
+    assert r.getArticleMeta(Item()) is meta
+    assert sorted(calls) == ['authors', 'page', 'source', 'url']
+
+def test_broken_images(tmpdir):
+    r = writer()
+    path = str(tmpdir.join('photo.jpg'))
+    Image.frombytes('RGB', (400, 300), os.urandom(400*300*3)).save(path)
+    assert r._fixBrokenImages(None, path) == 0
+    data = open(path, 'rb').read()
+    open(path, 'wb').write(data[:len(data)//2]) # header is intact, data is missing
+    r.fixed_images.clear()
+    assert r._fixBrokenImages(None, path) == -1
+    assert r._fixBrokenImages(None, path) == -1 # cached
+
+def test_fail_safe_check_not_counted(tmpdir):
+    r = writer(report=str(tmpdir.join('report.json')), nodetimes=str(tmpdir.join('nodetimes')))
+    r.doc = None
+    art = parseArticle(u'{|\n|-\n| a\n|}\n\ntext <math>x^2</math>')
+    r.report.startArticle(art.caption)
+    assert r.articleRenderingOK(copy.deepcopy(art), str(tmpdir.join('check.pdf')))
+    r.writeArticle(art)
+    assert r.report.counters['tables'] == r.report.article['tables'] == 1
+    assert r.report.counters['formulas'] == 1
+    assert r.node_timer.stats[(u'Test', 'Table')][0] == 1
+
+def test_untimed_report():
+    r = writer()
+    r.writeArticle(parseArticle(u'{|\n|-\n| a\n|}\n\ntext <math>x^2</math>'))
+    assert r.report.counters['tables'] == 1 and not r.report.phases
+
+def test_article_bookmarks():
+    r = writer()
+    r.bookmarks = [(u'Chapter', 'chapter')]
+    elements = r.writeArticle(parseArticle(u'== Section ==\ntext', title=u'Foo'))
+    assert r.bookmarks[1:] == [(u'Foo', 'article'), (u'Section ', 'heading2')]
+    assert '<a name="1"/>' in elements[0].text
+
+def test_license_key():
+    class License(object):
+        wikitext = u'license text'
+        _wiki = None
+    r = writer()
+    key = r._getLicenseKey(License(), u'License', 'config', 'book')
+    assert key == r._getLicenseKey(License(), u'License', 'config', 'book')
+    assert key != r._getLicenseKey(License(), u'License', 'config', 'other book')